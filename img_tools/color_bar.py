@@ -1,47 +1,93 @@
-""" A small script for generating colorbar in both horizontal and vertical shapes"""
+""" A small script for generating colorbar in both horizontal and vertical shapes
+The colormaps are converted to uint8 lookup tables (LUT) once, which can also be used to colorize scalar images
+"""
 import argparse
 import os
 import numpy as np
 from imageio import imsave
-from matplotlib import cm
+import matplotlib
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--horizontal', default=False, action='store_true')
+    parser.add_argument('--horizontal', default=False, action='store_true',
+            help='shortcut of --orientation horizontal')
+    parser.add_argument('--orientation', type=str, nargs='+', default=['vertical'],
+            help='vertical|horizontal, multiple orientations can be rendered in one call')
     parser.add_argument('--h', default=255, type=int, help='height of the color bar')
     parser.add_argument('--w', default=20,  type=int, help='width of the color bar')
-    parser.add_argument('--colormap', default='jet', help='jet|viridis') #
+    parser.add_argument('--colormap', type=str, nargs='+', default=['jet'],
+            help='name of any matplotlib colormap, e.g., jet viridis') # list
+    parser.add_argument('--levels', default=256, type=int, help='number of entries in the LUT, 256|65536')
     parser.add_argument('--save_dir', default='results/', help='save_dir')
     parser.add_argument('--format', default='png', help='jpg|png|pdf')
     args = parser.parse_args()
     return args
 
-def main(args):
-    bar = np.linspace(0, 1, args.h).reshape(-1, 1)  # A single vertical line [H, 1]
-    bar = bar.repeat(args.w, 1)  # A 2D bar of shape [H, W]
 
-    """ 
-    More types of colormap can be found in 
+""" Cache of the LUTs, indexed by (colormap, levels) """
+_lut_cache = {}
+
+
+def get_colormap_lut(colormap, levels=256):
+    """ Build the uint8 LUT of shape [levels, 3] for a matplotlib colormap, the LUT is built once and cached
+    More types of colormap can be found in
     https://matplotlib.org/3.5.1/tutorials/colors/colormaps.html
-    """ 
-    if args.colormap == 'jet':
-        colorbar = cm.jet(bar)[:, :, :3]
-    elif args.colormap == 'viridis':
-        colorbar = cm.viridis(bar)[:, :, :3]
-    else:
-        raise Exception('Undefined colormap %s' % args.colormap)
-    
-    if not os.path.exists(args.save_dir):
-        os.makedirs(args.save_dir)
-    save_name = os.path.join(args.save_dir, 'color_bar_%s' % args.colormap)
+    """
+    key = (colormap, levels)
+    if key not in _lut_cache:
+        if colormap not in matplotlib.colormaps:
+            raise Exception('Undefined colormap %s' % colormap)
+        cmap = matplotlib.colormaps[colormap]
+        if cmap.N != levels:
+            cmap = cmap.resampled(levels)
+
+        """ Same as cmap(x) for x in [0, 1], entry i is the color of x in [i/levels, (i+1)/levels) """
+        lut = cmap(np.arange(levels))[:, :3]
+        _lut_cache[key] = (lut * 255).astype(np.uint8)
+    return _lut_cache[key]
+
+
+def apply_colormap(values, colormap='jet', vmin=0.0, vmax=1.0, levels=256):
+    """ Colorize a scalar array of any shape with the LUT, return a uint8 array of shape [..., 3]
+    values outside [vmin, vmax] are clipped, NaN is treated as vmin
+    """
+    lut = get_colormap_lut(colormap, levels)
+    scale = levels / max(vmax - vmin, np.finfo(np.float32).eps)
+    index = np.nan_to_num((np.asarray(values, dtype=np.float32) - vmin) * scale, nan=0)
+    index = np.clip(index, 0, levels - 1).astype(np.intp)
+    return lut[index]
+
+
+def make_colorbar(colormap, h, w, horizontal=False, levels=256):
+    """ Only a single line [H] is colorized, and then repeated to a 2D bar of shape [H, W, 3] """
+    line = apply_colormap(np.linspace(0, 1, h), colormap, levels=levels)
+    colorbar = np.repeat(line.reshape(h, 1, 3), w, 1)
 
-    if args.horizontal:
+    if horizontal:
         """ By default the created colormap is vertical, transpose it to horizontal"""
         colorbar = colorbar.transpose([1, 0, 2])
-        save_name += '_horz'
-    
-    imsave(save_name + '.' + args.format, (colorbar * 255).astype(np.uint8))
+    return colorbar
+
+
+def main(args):
+    orientations = ['horizontal'] if args.horizontal else args.orientation
+
+    if not os.path.exists(args.save_dir):
+        os.makedirs(args.save_dir)
+
+    for colormap in args.colormap:
+        for orientation in orientations:
+            if orientation not in ['vertical', 'horizontal']:
+                raise Exception('Unknown orientation %s' % orientation)
+
+            colorbar = make_colorbar(colormap, args.h, args.w, orientation == 'horizontal', args.levels)
+
+            save_name = os.path.join(args.save_dir, 'color_bar_%s' % colormap)
+            if orientation == 'horizontal':
+                save_name += '_horz'
+            print('Saving %s' % (save_name + '.' + args.format))
+            imsave(save_name + '.' + args.format, colorbar)
 
 
 if __name__ == '__main__':
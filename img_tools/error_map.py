@@ -0,0 +1,150 @@
+""" A python script to colorize scalar maps (e.g., per-pixel error maps) with the colormaps in color_bar.py
+Input: a single map or a directory that contains maps in .npy, .exr, or 8/16-bit .png
+The maps are normalized with a shared vmin/vmax, so that they match the colorbar created by color_bar.py
+"""
+
+import argparse
+import os
+os.environ.setdefault('OPENCV_IO_ENABLE_OPENEXR', '1')  # has to be set before importing cv2 to read .exr
+import glob
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from color_bar import get_colormap_lut, apply_colormap, make_colorbar
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+
+    """ Specify the input """
+    parser.add_argument('--in_dir', default='', help='process all maps in the directory')
+    parser.add_argument('--in_map', default='', help='a single input map')
+    parser.add_argument('--key', default='*', help='select maps with the key in the file name')
+    parser.add_argument('--map_type', type=str, nargs='+', default=['.npy', '.exr', '.png'],
+            help='file types of the input maps, e.g., --map_type .npy .exr') # list
+
+    """ Specify the normalization and the colormap """
+    parser.add_argument('--vmin', default=None, type=float, help='value mapped to the start of the colormap')
+    parser.add_argument('--vmax', default=None, type=float,
+            help='value mapped to the end of the colormap, if vmin/vmax is not set, use the min/max of all maps')
+    parser.add_argument('--colormap', default='jet', help='name of any matplotlib colormap, e.g., jet|viridis')
+    parser.add_argument('--levels', default=256, type=int, help='number of entries in the LUT, 256|65536')
+    parser.add_argument('--channel', default=0, type=int, help='channel used for multi-channel maps')
+
+    """ Save directory and workers """
+    parser.add_argument('--save_dir', default='colorized')
+    parser.add_argument('--save_colorbar', default=1, type=int,
+            help='save the matching colorbar to the save_dir, 1 for True, 0 for False')
+    parser.add_argument('--workers', default=8, type=int, help='number of threads for reading and writing')
+    args = parser.parse_args()
+    return args
+
+
+class ErrorMapColorizer(object):
+    """ A class takes map path/directory as input, and colorizes the maps with a shared LUT """
+
+    def __init__(self, cfgs):
+        self.cfgs = cfgs
+        """ print configurations """
+        for k, v in cfgs.items():
+            print('\t%s: %s' % (k, v))
+
+        assert (cfgs['in_dir'] != '' or cfgs['in_map'] != ''), "Aleast one of the --in_dir or --in_map should be set"
+
+        """ Get map names """
+        self.map_names = self.load_map_list()
+
+    def load_map_list(self):
+        """ Load a single map or a batch of maps in a directory """
+        cfgs = self.cfgs
+
+        if cfgs['in_dir'] != '':
+            map_names = sorted(glob.glob(os.path.join(cfgs['in_dir'], cfgs['key'])))
+            print('Input dir: %s' % cfgs['in_dir'])
+        else:
+            map_names = [cfgs['in_map']]
+            print('Input map: %s' % cfgs['in_map'])
+
+        map_names = [f for f in map_names if not os.path.isdir(f) and os.path.splitext(f)[1] in cfgs['map_type']]
+        print('Found %d maps' % len(map_names))
+        return map_names
+
+    def colorize_batch_maps(self):
+        cfgs = self.cfgs
+        save_dir = self.get_save_dir()
+
+        """ Build the LUT once, it is shared by all threads """
+        get_colormap_lut(cfgs['colormap'], cfgs['levels'])
+
+        with ThreadPoolExecutor(max_workers=cfgs['workers']) as pool:
+            vmin, vmax = cfgs['vmin'], cfgs['vmax']
+            if vmin is None or vmax is None:
+                """ Use the range of all maps, this needs an extra pass over the maps """
+                ranges = list(pool.map(self.get_map_range, self.map_names))
+                vmin = min([r[0] for r in ranges]) if vmin is None else vmin
+                vmax = max([r[1] for r in ranges]) if vmax is None else vmax
+            print('Normalize maps with vmin %f, vmax %f' % (vmin, vmax))
+
+            jobs = [pool.submit(self.colorize_map, map_name, save_dir, vmin, vmax) for map_name in self.map_names]
+            for i, job in enumerate(jobs):
+                print('[Map %d/%d] Saved %s' % (i+1, len(jobs), job.result()))
+
+        if cfgs['save_colorbar']:
+            colorbar = make_colorbar(cfgs['colormap'], 255, 20, levels=cfgs['levels'])
+            save_name = os.path.join(save_dir, 'color_bar_%s.png' % cfgs['colormap'])
+            cv2.imwrite(save_name, colorbar[:, :, ::-1])
+            print('Saved colorbar %s, from %f (top) to %f (bottom)' % (save_name, vmin, vmax))
+
+    def colorize_map(self, map_name, save_dir, vmin, vmax):
+        cfgs = self.cfgs
+        color_map = apply_colormap(self.read_map(map_name), cfgs['colormap'], vmin, vmax, cfgs['levels'])
+
+        save_name = os.path.splitext(os.path.basename(map_name))[0] + '_%s.png' % cfgs['colormap']
+        save_name = os.path.join(save_dir, save_name)
+        cv2.imwrite(save_name, color_map[:, :, ::-1])  # RGB to BGR
+        return save_name
+
+    def get_map_range(self, map_name):
+        scalar_map = self.read_map(map_name)
+        return np.nanmin(scalar_map), np.nanmax(scalar_map)
+
+    def read_map(self, map_path):
+        """ Read a map as a 2D float32 array, integer images are normalized to [0, 1] """
+        if map_path.endswith('.npy'):
+            scalar_map = np.load(map_path)
+        else:
+            scalar_map = cv2.imread(map_path, cv2.IMREAD_UNCHANGED)
+            if scalar_map is None:
+                raise Exception('Cannot read map: %s' % map_path)
+
+        if scalar_map.dtype == np.uint8:
+            scalar_map = scalar_map.astype(np.float32) / 255.0
+        elif scalar_map.dtype == np.uint16:
+            scalar_map = scalar_map.astype(np.float32) / 65535.0
+        else:
+            scalar_map = scalar_map.astype(np.float32, copy=False)
+
+        if scalar_map.ndim == 3:
+            scalar_map = scalar_map[:, :, self.cfgs['channel']]
+        elif scalar_map.ndim != 2:
+            raise Exception('Unknown map shape: %s' % str(scalar_map.shape))
+        return scalar_map
+
+    def get_save_dir(self):
+        cfgs = self.cfgs
+        in_dir = cfgs['in_dir'] if cfgs['in_dir'] != '' else os.path.dirname(cfgs['in_map'])
+        save_dir = os.path.join(in_dir, cfgs['save_dir'])
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        return save_dir
+
+
+def main(args):
+    cfgs = vars(args)
+    colorizer = ErrorMapColorizer(cfgs)
+    colorizer.colorize_batch_maps()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    main(args)
@@ -5,6 +5,7 @@ Input: a single image or a directory that contains images, locations (top, left,
 import argparse
 import os
 import glob
+import json
 import cv2
 import numpy as np
 
@@ -16,7 +17,7 @@ def parse_arguments():
     parser.add_argument('--in_dir', default='', help='process all images in the directory')
     parser.add_argument('--in_img', default='', help='a single input image')
     parser.add_argument('--key', default='*', help='select images with the key in the file name')
-    parser.add_argument('--img_type', type=str, nargs='+', default=['.jpg', '.png', '.tif'],
+    parser.add_argument('--img_type', type=str, nargs='+', default=['.jpg', '.jpeg', '.png', '.tif', '.tiff'],
             help='specify color (e.g., k|r|b|g|y) for each box, e.g., --colors r b') # list
 
     """ Specify the box location (top, left, bottom, right) """
@@ -59,11 +60,34 @@ def parse_arguments():
     parser.add_argument('--iscale', default=2.57, type=float)
     parser.add_argument('--overlap', default=False, action='store_true') # overlap cropped images
 
+    """ Tile the cropped patches into a contact sheet (rows are images, columns are boxes) """
+    parser.add_argument('--montage', default=False, action='store_true',
+            help='tile the cropped patches into a grid, rows are images and columns are boxes')
+    parser.add_argument('--montage_rows', default=0, type=int,
+            help='maximum number of image rows in a sheet, 0 puts all images in one sheet')
+    parser.add_argument('--montage_pad', default=4, type=int, help='padding between patches in px')
+    parser.add_argument('--montage_label', default=1, type=int,
+            help='put the image name at the left of each row, 1 for True, 0 for False')
+    parser.add_argument('--save_patch', default=1, type=int,
+            help='save each cropped patch as a separate file, 1 for True, 0 for False')
+
     """ Save directory and name """
-    parser.add_argument('--save_ext', default='.png')
+    parser.add_argument('--save_ext', default='.png', help='.png|.jpg|.jpeg|.webp|.tif|.tiff')
+
+    """ Encode options, trade file size for saving speed """
+    parser.add_argument('--png_compression', default=-1, type=int,
+            help='png compression level from 0 (fastest) to 9 (smallest), -1 for the OpenCV default')
+    parser.add_argument('--jpg_quality', default=95, type=int, help='jpg quality from 0 to 100')
+    parser.add_argument('--jpg_optimize', default=0, type=int,
+            help='optimize the huffman table of jpg, smaller but slower, 1 for True, 0 for False')
+    parser.add_argument('--webp_quality', default=90, type=int, help='lossy webp quality from 1 to 100')
+    parser.add_argument('--webp_lossless', default=0, type=int, help='save lossless webp, 1 for True, 0 for False')
     parser.add_argument('--save_dir', default='ROI')
     parser.add_argument('--rename', default=0, type=int, 
             help='ignore the original image name, 1 for True, 0 for False')
+    parser.add_argument('--incremental', default=False, action='store_true',
+            help='only process images whose file or crop parameters changed since the last run, \
+            and remove outputs whose source images were removed')
     args = parser.parse_args()
     return args
 
@@ -80,6 +104,7 @@ class ImageCropper(object):
             print('\t%s: %s' % (k, v))
         
         self.check_cfgs(cfgs)
+        self.montage_key = ':montage'  # manifest entry of the montage sheets, not a source image
 
         """ Get image names """
         self.img_names = self.load_image_list()
@@ -102,17 +127,22 @@ class ImageCropper(object):
                 'The number of colors should either be 0 or equals to the boxes'
 
         print('Found %d boxes' % len(cfgs['boxes']))
+        assert not cfgs['montage'] or len(cfgs['boxes']) > 0, 'At least one box is required for --montage'
 
         """ Check arrows """
         assert len(cfgs['arrows']) == len(cfgs['arrow_color']), \
                 'The number of arrow colors should equals to the boxes'
 
+        """ Check save format """
+        assert cfgs['save_ext'].lower() in ['.png', '.jpg', '.jpeg', '.webp', '.tif', '.tiff'], \
+                'Unknown save_ext: %s' % cfgs['save_ext']
+
     def load_image_list(self):
         """ Load a single image or a batch of images in a directory """
         cfgs = self.cfgs
 
         if cfgs['in_dir'] != '':
-            img_names = glob.glob(os.path.join(cfgs['in_dir'], cfgs['key']))
+            img_names = sorted(glob.glob(os.path.join(cfgs['in_dir'], cfgs['key'])))  # deterministic rows of montage
             print('Input dir: %s' % cfgs['in_dir'])
         else:
             img_names = [cfgs['in_img']]
@@ -126,7 +156,7 @@ class ImageCropper(object):
         """ filter out directory and files that are not ended with jpg/png/tif """
         img_names = []
         for f in file_names:
-            if os.path.isdir(f) or f[-4:] not in self.cfgs['img_type']:
+            if os.path.isdir(f) or os.path.splitext(f)[1].lower() not in self.cfgs['img_type']:
                 continue
             img_names.append(f)
         return img_names
@@ -139,7 +169,32 @@ class ImageCropper(object):
                each box has a list to cache the patches""" 
             cropped_caches = [[] * len(cfgs['boxes'])]
 
+        if cfgs['montage']:
+            """ The sheet is allocated when its first row is produced """
+            layout = self.get_montage_layout()
+            sheet = None
+
+        if cfgs['incremental']:
+            """ The manifest records the inputs and outputs of each processed image """
+            manifest_path = self.get_manifest_path()
+            manifest = self.load_manifest(manifest_path)
+            stale_outputs = self.prune_manifest(manifest)
+            montage_outputs = []
+
         for i_img, img_name in enumerate(self.img_names):
+
+            """ Skip the image if its inputs did not change since the last run
+            The patches are still needed when building the montage or the overlapped images
+            """
+            up_to_date = False
+            if cfgs['incremental']:
+                signature = self.get_input_signature(i_img, img_name)
+                up_to_date = self.is_up_to_date(manifest, img_name, signature)
+                if up_to_date:
+                    print('[Image %d/%d] %s: up to date' % (i_img+1, len(self.img_names), img_name))
+                    if not (cfgs['montage'] or cfgs['overlap']):
+                        continue
+            outputs = []
             
             """ Load image """
             img = self.read_img(img_name)
@@ -170,16 +225,40 @@ class ImageCropper(object):
                 cropped_img = img[t:b, l:r]
 
                 save_dir, save_name = self.get_save_dir_save_name(i_img, i_b, img_name, add_box_id=len(boxes)>1)
-                self.save_img(os.path.join(save_dir, save_name), cropped_img)
+                if cfgs['save_patch'] and not up_to_date:
+                    self.save_img(os.path.join(save_dir, save_name), cropped_img)
+                    outputs.append(os.path.join(save_dir, save_name))
                 
                 """ Cache the patches for overlapping """
                 if cfgs['overlap']:
                     cropped_caches[i_b].append(cropped_img)
 
+                """ Copy the patch into its cell of the montage sheet """
+                if cfgs['montage']:
+                    if sheet is None:
+                        sheet = self.new_montage_sheet(i_img, layout)
+                    self.put_montage_patch(sheet, i_img % layout['rows'], i_b, cropped_img, layout)
+
             """ Save the arrows/boxes highlighted input images """ 
-            if len(cfgs['arrows']) > 0 or (len(cfgs['boxes']) > 0 and len(cfgs['colors']) > 0):
-                drawed_img_name = os.path.basename(img_name)[:-4] + '_draw' + cfgs['save_ext']
+            if not up_to_date and (len(cfgs['arrows']) > 0 or (len(cfgs['boxes']) > 0 and len(cfgs['colors']) > 0)):
+                drawed_img_name = os.path.splitext(os.path.basename(img_name))[0] + '_draw' + cfgs['save_ext']
                 self.save_img(os.path.join(save_dir, drawed_img_name), img)
+                outputs.append(os.path.join(save_dir, drawed_img_name))
+
+            if cfgs['incremental'] and not up_to_date:
+                stale_outputs += self.update_manifest(manifest, img_name, signature, outputs)
+
+            """ Label the row and save the sheet once it is full """
+            if cfgs['montage'] and sheet is not None:
+                if cfgs['montage_label']:
+                    self.put_montage_label(sheet, i_img % layout['rows'], img_name, layout)
+
+                if (i_img + 1) % layout['rows'] == 0 or i_img + 1 == len(self.img_names):
+                    save_name = '%02d_montage_' % (i_img // layout['rows']) + self.get_save_suffix()
+                    self.save_img(os.path.join(save_dir, save_name), sheet)
+                    sheet = None
+                    if cfgs['incremental']:
+                        montage_outputs.append(os.path.join(save_dir, save_name))
         
         """ Save overlapped patches images if required """
         if cfgs['overlap']:
@@ -188,6 +267,142 @@ class ImageCropper(object):
                 save_name = '%02d_overlapped_img' % (i) + cfgs['save_ext']
                 self.save_img(os.path.join(save_dir, save_name), overlapped_img)
 
+        if cfgs['incremental']:
+            if cfgs['montage']:
+                stale_outputs += self.update_manifest(manifest, self.montage_key, None, montage_outputs)
+            self.remove_stale_outputs(manifest, stale_outputs)
+            self.save_manifest(manifest_path, manifest)
+
+    def get_manifest_path(self):
+        """ The manifest is stored in the save_dir of the input directory """
+        cfgs = self.cfgs
+        in_dir = cfgs['in_dir'] if cfgs['in_dir'] != '' else os.path.dirname(cfgs['in_img'])
+        save_dir = os.path.join(in_dir, cfgs['save_dir'])
+        self.make_dir(save_dir)
+        return os.path.join(save_dir, '.manifest.json')
+
+    def load_manifest(self, manifest_path):
+        if not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest_path, manifest):
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        print('Saved manifest of %d images: %s' % (len(manifest), manifest_path))
+
+    def get_input_signature(self, idx, img_name):
+        """ The source file state and all parameters that affect the outputs of an image """
+        cfgs = self.cfgs
+        stat = os.stat(img_name)
+        params = ['boxes', 'colors', 'thick', 'arrows', 'arrow_thick', 'arrow_color', 'keep_alpha',
+                  'do_gamma', 'gamma', 'do_iscale', 'iscale', 'save_ext', 'save_dir', 'rename', 'save_patch',
+                  'png_compression', 'jpg_quality', 'jpg_optimize', 'webp_quality', 'webp_lossless']
+        signature = {'mtime': stat.st_mtime, 'size': stat.st_size}
+        signature.update({k: cfgs[k] for k in params})
+        if cfgs['rename']:  # the save name depends on the image index
+            signature['index'] = idx
+        return signature
+
+    def is_up_to_date(self, manifest, img_name, signature):
+        """ An image is up to date if its signature is unchanged and all its outputs exist """
+        entry = manifest.get(os.path.abspath(img_name))
+        if entry is None or entry['signature'] != signature:
+            return False
+        return all([os.path.exists(f) for f in entry['outputs']])
+
+    def update_manifest(self, manifest, img_name, signature, outputs):
+        """ Record the outputs of an image, return the old outputs that are not produced anymore """
+        outputs = [os.path.abspath(f) for f in outputs]
+        key = img_name if img_name == self.montage_key else os.path.abspath(img_name)
+        stale = [f for f in manifest[key]['outputs'] if f not in outputs] if key in manifest else []
+        manifest[key] = {'signature': signature, 'outputs': outputs}
+        return stale
+
+    def prune_manifest(self, manifest):
+        """ Drop the images whose source were removed, return their outputs """
+        stale = []
+        for key in list(manifest.keys()):
+            if key != self.montage_key and not os.path.exists(key):
+                print('Source removed, pruning outputs: %s' % key)
+                stale += manifest[key]['outputs']
+                del manifest[key]
+        return stale
+
+    def remove_stale_outputs(self, manifest, stale):
+        """ Remove the old outputs after all images are processed. With --rename 1, the save names depend on the
+        image index, so an old output of an image may have been written by another image in this run
+        """
+        current = set([f for entry in manifest.values() for f in entry['outputs']])
+        self.remove_files([f for f in sorted(set(stale)) if f not in current])
+
+    def remove_files(self, file_names):
+        for f in file_names:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def get_montage_layout(self):
+        """ Compute the cell locations of the montage sheet
+        All patches of a box share the same size, so each box owns a column of a fixed width
+        """
+        cfgs = self.cfgs
+        pad = cfgs['montage_pad']
+        heights = [b - t for t, l, b, r in cfgs['boxes']]
+        widths = [r - l for t, l, b, r in cfgs['boxes']]
+
+        layout = {'pad': pad, 'font': cv2.FONT_HERSHEY_SIMPLEX, 'font_scale': 0.5, 'font_thick': 1}
+
+        """ The sheet has a fixed channel number, as the images may mix gray, color and alpha channels """
+        layout['channels'] = 4 if cfgs['keep_alpha'] else 3
+
+        label_w = 0
+        if cfgs['montage_label'] and len(self.img_names) > 0:
+            label_w = max([cv2.getTextSize(self.get_montage_label(name), layout['font'],
+                    layout['font_scale'], layout['font_thick'])[0][0] for name in self.img_names]) + pad
+
+        layout['rows'] = cfgs['montage_rows'] if cfgs['montage_rows'] > 0 else max(len(self.img_names), 1)
+        layout['row_h'] = max(heights) + pad
+        layout['col_x'] = label_w + pad + np.cumsum([0] + [w + pad for w in widths[:-1]])
+        layout['width'] = label_w + pad + sum(widths) + pad * len(widths)
+        return layout
+
+    def new_montage_sheet(self, i_img, layout):
+        """ Preallocate a white (and opaque) sheet for the rows starting from the i_img-th image """
+        nrows = min(layout['rows'], len(self.img_names) - i_img)
+        height = layout['pad'] + nrows * layout['row_h']
+        return np.ones((height, layout['width'], layout['channels']), dtype=np.float32)
+
+    def put_montage_patch(self, sheet, row, i_box, patch, layout):
+        y = layout['pad'] + row * layout['row_h']
+        x = layout['col_x'][i_box]
+        h, w = patch.shape[:2]
+        sheet[y:y+h, x:x+w] = self.convert_channels(patch, sheet.shape[2])
+
+    def convert_channels(self, patch, c):
+        """ Convert a gray (1), BGR (3) or BGRA (4) patch to c (3 or 4) channels, the added alpha channel is opaque """
+        if patch.shape[2] == 1:
+            patch = np.repeat(patch, 3, axis=2)
+        if patch.shape[2] < c:
+            patch = np.concatenate([patch, np.ones_like(patch[:, :, :1])], axis=2)
+        return patch[:, :, :c]
+
+    def put_montage_label(self, sheet, row, img_name, layout):
+        """ Put the image name at the vertical center of the row
+        cv2.putText only draws on uint8 images, so the label is drawn on a uint8 strip first
+        """
+        text = self.get_montage_label(img_name)
+        (text_w, text_h), _ = cv2.getTextSize(text, layout['font'], layout['font_scale'], layout['font_thick'])
+        y = layout['pad'] + row * layout['row_h']
+        strip = np.full((layout['row_h'] - layout['pad'], layout['col_x'][0] - layout['pad'], layout['channels']),
+                255, dtype=np.uint8)
+        cv2.putText(strip, text, (layout['pad'], (strip.shape[0] + text_h) // 2), layout['font'],
+                layout['font_scale'], color=(0, 0, 0, 255), thickness=layout['font_thick'], lineType=cv2.LINE_AA)
+        sheet[y:y+strip.shape[0], layout['pad']:layout['col_x'][0]] = strip / 255.0
+
+    def get_montage_label(self, img_name):
+        return os.path.splitext(os.path.basename(img_name))[0]
+
     def draw_arrows(self, img, cfgs):
         arrow_coords = cfgs['arrows']
 
@@ -228,15 +443,37 @@ class ImageCropper(object):
         return img
 
     def save_img(self, save_name, image):
-        save_ext = save_name[-3:]
+        save_ext = os.path.splitext(save_name)[1].lower()
         # print('\tSaving %s' % os.path.join(save_name))
 
-        if save_ext in ['jpg', 'png']:
-            cv2.imwrite(save_name, (image * 255).astype(np.uint8))
-        elif save_ext in ['tif']:
-            cv2.imwrite(save_name, (image * 65535).astype(np.uint16))
+        if save_ext in ['.jpg', '.jpeg', '.png', '.webp']:
+            ok = cv2.imwrite(save_name, self.quantize_img(image, 8), self.get_encode_params(save_ext))
+        elif save_ext in ['.tif', '.tiff']:
+            ok = cv2.imwrite(save_name, self.quantize_img(image, 16))
         else:
-            raise Exception('Unknown save_name: %s', save_ext)
+            raise Exception('Unknown save_name: %s' % save_name)
+
+        if not ok:
+            raise Exception('Failed to save image: %s' % save_name)
+
+    def quantize_img(self, image, bit_depth=8):
+        """ Scale a float image in [0, 1] to uint8/uint16 in a single pass
+        cv2.multiply clips (saturates) and rounds the values without creating a temporary float array
+        """
+        max_val, dtype = (255.0, cv2.CV_8U) if bit_depth == 8 else (65535.0, cv2.CV_16U)
+        return cv2.multiply(image, (max_val,) * 4, dtype=dtype)
+
+    def get_encode_params(self, save_ext):
+        """ Encode parameters of cv2.imwrite for each format """
+        cfgs = self.cfgs
+        if save_ext == '.png' and cfgs['png_compression'] >= 0:
+            return [cv2.IMWRITE_PNG_COMPRESSION, cfgs['png_compression']]
+        elif save_ext in ['.jpg', '.jpeg']:
+            return [cv2.IMWRITE_JPEG_QUALITY, cfgs['jpg_quality'], cv2.IMWRITE_JPEG_OPTIMIZE, cfgs['jpg_optimize']]
+        elif save_ext == '.webp':
+            # libwebp switches to the lossless mode when the quality is above 100
+            return [cv2.IMWRITE_WEBP_QUALITY, 101 if cfgs['webp_lossless'] else cfgs['webp_quality']]
+        return []
 
     def process_img(self, img, cfgs):
 
@@ -272,9 +509,9 @@ class ImageCropper(object):
                 save_name = '%02d' % (idx)
         else:
             if add_box_id:
-                save_name = os.path.basename(img_name)[:-4] + '_%02d' % i_box
+                save_name = os.path.splitext(os.path.basename(img_name))[0] + '_%02d' % i_box
             else:
-                save_name = os.path.basename(img_name)[:-4]
+                save_name = os.path.splitext(os.path.basename(img_name))[0]
 
         save_name = save_name + '_' + self.get_save_suffix()
         return save_dir, save_name
@@ -2,14 +2,149 @@
 A simple wrapper for pyplot
 """
 import os
+import copy
+import glob
+import hashlib
+import itertools
+import io
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import matplotlib; matplotlib.use('agg')
-import matplotlib.pyplot as plt
 
-""" Set font """
-from matplotlib import rcParams
-rcParams['font.family'] = "Times New Roman"
-# rcParams['font.family'] = 'serif' #'sans-serif'
+""" Font of the figures """
+FONT_FAMILY = "Times New Roman"
+# FONT_FAMILY = 'serif' #'sans-serif'
+
+""" Generic family used if FONT_FAMILY is not installed, e.g., 'serif'
+If None, FONT_FAMILY is set anyway and matplotlib falls back to its default font
+"""
+FONT_FALLBACK = None
+
+_pyplot = None
+
+
+def load_pyplot():
+    """ Import pyplot on first render, so that parsing configs does not load matplotlib """
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib; matplotlib.use('agg')
+        import matplotlib.pyplot as pyplot
+        set_font(FONT_FAMILY, FONT_FALLBACK)
+        _pyplot = pyplot
+    return _pyplot
+
+
+def set_font(family, fallback=None):
+    """ Set the font family, the fallback is only used if it is given and the font is not in the font cache
+    of matplotlib (stored in matplotlib.get_cachedir(), set MPLCONFIGDIR to keep it across fresh containers)
+    """
+    from matplotlib import rcParams, font_manager
+    if fallback is None:
+        rcParams['font.family'] = family
+        return
+
+    font_names = set([f.name for f in font_manager.fontManager.ttflist])
+    if family in font_names or family in ['serif', 'sans-serif', 'monospace', 'cursive', 'fantasy']:
+        rcParams['font.family'] = family
+    else:
+        print('Font %s is not found in the font cache, use %s instead' % (family, fallback))
+        rcParams['font.family'] = fallback
+        if fallback in ['serif', 'sans-serif', 'monospace', 'cursive', 'fantasy']:
+            key = 'font.' + fallback
+            rcParams[key] = [family] + [f for f in rcParams[key] if f != family]
+
+
+class _LazyPyplot(object):
+    """ Stand-in of matplotlib.pyplot, pyplot is imported on first attribute access """
+    def __getattr__(self, name):
+        return getattr(load_pyplot(), name)
+
+
+plt = _LazyPyplot()
+
+
+""" Formats encoded from the pixels of the Agg canvas, the others are vector formats """
+RASTER_FORMATS = ['png', 'jpg', 'jpeg', 'tif', 'tiff', 'webp']
+
+
+class _RGBABuffer(io.BytesIO):
+    """ Keep the RGBA canvas written by savefig(format='rgba') as an array of shape [H, W, 4] """
+    def write(self, buf):
+        self.image = np.array(buf)
+        return self.image.nbytes
+
+
+class CurveSet(object):
+    """ A set of curves stored in one 2D array of shape [max_point_num, ncurves]
+    The array is in Fortran order, so that each curve is a contiguous column, and indexing a curve
+    returns a zero-copy view. Indexing with a slice, e.g., data[::2], returns a CurveSet sharing the same array.
+    Curves may have different lengths, the unused entries at the end of a column are NaN.
+    """
+
+    def __init__(self, values, lengths=None, names=None):
+        self.values = values
+        self.lengths = list(lengths) if lengths is not None else [values.shape[0]] * values.shape[1]
+        self.names = list(names) if names is not None else ['%d' % i for i in range(values.shape[1])]
+        self._index_x = {}  # shared x values [0, ..., n-1], indexed by n
+
+    @classmethod
+    def from_columns(cls, columns, names=None, dtype=np.float64):
+        """ Copy a list of 1D arrays into a new CurveSet """
+        lengths = [len(c) for c in columns]
+        values = np.full((max(lengths + [0]), len(columns)), np.nan, dtype=dtype, order='F')
+        for i, c in enumerate(columns):
+            values[:lengths[i], i] = c
+        return cls(values, lengths, names)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            ids = range(len(self))[idx]
+            return CurveSet(self.values[:, idx], [self.lengths[i] for i in ids], [self.names[i] for i in ids])
+        return self.values[:self.lengths[idx], idx]
+
+    def __setitem__(self, idx, curve):
+        """ Overwrite a curve in place, the length of the curve cannot be changed """
+        assert len(curve) == self.lengths[idx], 'The length of the curve cannot be changed'
+        self.values[:self.lengths[idx], idx] = curve
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return 'CurveSet(%d curves, %d points, %s, names=%s)' % (
+                len(self), self.values.shape[0], self.values.dtype, self.names)
+
+    def column(self, name):
+        return self[self.names.index(name)]
+
+    def min_max(self):
+        """ Global min and max of all curves in a single pass over the array, the NaN padding is ignored """
+        if self.values.size == 0:
+            return np.nan, np.nan
+        return np.nanmin(self.values), np.nanmax(self.values)
+
+    def take_points(self, order):
+        """ Reorder the points of all curves with one fancy index, return a new CurveSet
+        All curves should have the same length as order
+        """
+        n = len(order)
+        assert all([l == n for l in self.lengths]), 'All curves should have %d points' % n
+        values = np.empty((n, len(self)), dtype=self.values.dtype, order='F')
+        np.take(self.values[:n], order, axis=0, out=values)
+        return CurveSet(values, self.lengths, self.names)
+
+    def index_x(self, i):
+        """ x values [0, ..., len(y)-1] of the i-th curve, curves of the same length share the same array """
+        n = self.lengths[i]
+        if n not in self._index_x:
+            self._index_x[n] = np.arange(n, dtype=self.values.dtype)
+        return self._index_x[n]
 
 
 class PlotAgent(object):
@@ -25,14 +160,23 @@ class PlotAgent(object):
                 # Plot type: ploty|plotxy|plottwins|plotbar
                 'plot_type': 'ploty',
 
-                # Figure format: pdf|jpg|png
-                'format': 'pdf',
+                # Figure format: pdf|jpg|png|svg, multiple formats are saved from a single draw
+                'format': ['pdf'],
+                'format_dpi': [],  # dpi of each format, e.g., png:300 jpg:150, the canvas dpi is used if not set
 
                 # Canvas: width, height, and dpi
                 'width': 3,
                 'height': 3,
                 'dpi': 220,
 
+                # Output size of vector figures (pdf|svg|eps)
+                'font_type': 3,  # 3|42, 42 embeds subsetted TrueType fonts, which are smaller and editable in pdf
+                'path_simplify': True,  # merge nearly collinear vertices of the lines
+                'simplify_threshold': 'default',  # default|auto|float, auto merges vertices within one pixel at dpi
+                'pdf_compression': 6,  # 0-9, zlib level of the pdf streams
+                'strip_metadata': False,  # remove the date and creator, and the unreferenced ids in svg
+                'size_report': False,  # print the bytes saved compared to the default output options
+
                 # Title:
                 'title': '',
                 'title_font': 'x-large',
@@ -78,9 +222,17 @@ class PlotAgent(object):
                 # Data
                 'datafile': [],  # each file stores the data of a curve
                 'max_point_num': 1000,  # limits the maximum number of points
+                'data_dtype': 'float64',  # float64|float32, float32 halves the memory of wide files
                 'sort_data': 'None',  # sort Y values based on the first curve, options: None|ascend|descend
+
+                # Sweep: lines start with ~ declare the values of a parameter, e.g., ~ title A | B | C
+                'sweep_mode': 'product',  # product|zip, the cartesian product of the sweep axes, or their i-th values
+                'sweep_name': '',  # suffix of the save name of a variant, e.g., {title}_{y_max}, default is its index
                 }
 
+        """ Parameters used to load the data, variants of a sweep with the same values share the loaded data """
+        self.data_params = ['datafile', 'max_point_num', 'data_dtype']
+
         """ Special symbols in the configuration file *.conf
             When parsing the config file, lines start with # will be ignored,
             lines start with ! will be parsed and set
@@ -89,6 +241,14 @@ class PlotAgent(object):
         self.config_symbols = ['!']
         self.space_symbol = '&' # Values in conf file containing & will be replaced by space
 
+        """ Lines start with ~ declare a sweep axis, the values of the parameter are separated by |
+            e.g., ~ datafile data/a1.txt data/a2.txt | data/b1.txt data/b2.txt
+        """
+        self.sweep_symbols = ['~']
+        self.value_separator = '|'
+        self.sweep = []  # [(param, [vals of each value])]
+        self.sweep_values = {}  # values of the sweep axes of a variant
+
     def get_config(self):
         return self.conf
 
@@ -114,58 +274,144 @@ class PlotAgent(object):
             flag = line_splits[0]
             if (flag in self.ignore_symbols) or (flag == '') or (flag[0] in self.ignore_symbols):
                 continue
+            if flag in self.sweep_symbols:
+                self.add_sweep_axis(line_splits[1], line_splits[2:], strict)
+                continue
             if flag not in self.config_symbols:
                 raise Exception('Unknown flag in the config %s' % flag)
                 break
 
-            param, val = line_splits[1], line_splits[2]
-
-            if param in conf:
-                if type(conf[param]) in [float, int]:
-                    conf[param] = float(val)
-                elif type(conf[param]) == str:
-                    conf[param] = val.replace(self.space_symbol, ' ')
-                elif type(conf[param]) == list:
-                    conf[param] = [v.replace(self.space_symbol, ' ') for v in line_splits[2:]]
-                elif type(conf[param]) == bool:
-                    conf[param] = True if int(val) == 1 else False
-                else:
-                    raise Exception('Unknown parameters type: %s' % param)
-            else:
-                if strict:
-                    raise Exception('Unknown parameters: %s' % param)
+            self.set_param(line_splits[1], line_splits[2:], strict)
 
+        self.resolve_datafiles(fname)
+        conf['confname'] = fname
+        for k, v in conf.items():
+            print(k, v)
+        return conf
+
+    def resolve_datafiles(self, fname):
         """ Check path of the data files"""
+        conf = self.conf
         for i, df in enumerate(conf['datafile']):
             if not os.path.exists(df):
                 """ Use relative path """
                 dirname = os.path.dirname(fname)
                 conf['datafile'][i] = os.path.join(dirname, df)
 
-        conf['confname'] = fname
-        for k, v in conf.items():
-            print(k, v)
-        return conf
+    def add_sweep_axis(self, param, vals, strict=True):
+        """ Split the values of a sweep line by |, each value is a list of strings as in set_param """
+        if param not in self.conf:
+            if strict:
+                raise Exception('Unknown parameters: %s' % param)
+            return
+
+        values, value = [], []
+        for v in vals + [self.value_separator]:
+            if v != self.value_separator:
+                value.append(v)
+            elif len(value) > 0:
+                values.append(value)
+                value = []
+        if len(values) == 0:
+            raise Exception('Empty sweep axis: %s' % param)
+        self.sweep.append((param, values))
+
+    def expand_sweep(self):
+        """ Expand the sweep axes into a list of agents, one for each variant
+        The config is not parsed again, each variant copies the parsed config and sets the values of its sweep axes
+        """
+        if len(self.sweep) == 0:
+            return [self]
+
+        params = [param for param, _ in self.sweep]
+        axes = [values for _, values in self.sweep]
+        if self.conf['sweep_mode'] == 'product':
+            combinations = list(itertools.product(*axes))
+        elif self.conf['sweep_mode'] == 'zip':
+            if len(set([len(values) for values in axes])) > 1:
+                raise Exception('Sweep axes %s have different numbers of values' % ', '.join(params))
+            combinations = list(zip(*axes))
+        else:
+            raise Exception('Unknown sweep mode %s' % self.conf['sweep_mode'])
+
+        agents = []
+        for combination in combinations:
+            agent = copy.copy(self)
+            agent.conf = copy.deepcopy(self.conf)
+            agent.sweep = []
+            agent.sweep_values = {'index': '%02d' % len(agents)}
+            for param, vals in zip(params, combination):
+                agent.set_param(param, vals)
+                agent.sweep_values[param] = '-'.join([os.path.basename(v) for v in vals])
+            agent.resolve_datafiles(self.conf['confname'])
+            agents.append(agent)
+        print('Expanded %d sweep variants of %s' % (len(agents), self.conf['confname']))
+        return agents
+
+    def get_data_key(self):
+        """ Variants with the same key can share the loaded data """
+        return json.dumps([self.conf[param] for param in self.data_params])
+
+    def set_param(self, param, vals, strict=True):
+        """ Set a parameter from a list of strings (the values following the parameter name in the config)
+        The data type is determined by the default value in self.conf
+        """
+        conf = self.conf
+        val = vals[0]
+
+        if param in conf:
+            if type(conf[param]) in [float, int]:
+                conf[param] = float(val)
+            elif type(conf[param]) == str:
+                conf[param] = val.replace(self.space_symbol, ' ')
+            elif type(conf[param]) == list:
+                conf[param] = [v.replace(self.space_symbol, ' ') for v in vals]
+            elif type(conf[param]) == bool:
+                conf[param] = True if int(val) == 1 else False
+            else:
+                raise Exception('Unknown parameters type: %s' % param)
+        else:
+            if strict:
+                raise Exception('Unknown parameters: %s' % param)
 
-    def load_data_from_file(self, files, max_point_num=100, skip=0, nan_value=0, max_curve_num=-1):
-        """ Load data from list of files, data of each curve is stored in a file"""
+    def update_config(self, params, strict=True):
+        """ Set parameters from a dict, e.g., a config sent as JSON
+        Values are converted to strings, so they are parsed in the same way as the config file
+        """
+        for param, val in params.items():
+            vals = val if type(val) == list else [val]
+            vals = [str(int(v)) if type(v) == bool else str(v) for v in vals]
+            self.set_param(param, vals, strict)
+        return self.conf
+
+    def load_data_from_file(self, files, max_point_num=100, skip=0, nan_value=0, max_curve_num=-1, dtype='float64'):
+        """ Load data from list of files, data of each curve is stored in a file
+        A file with multiple columns contains multiple curves. Return a CurveSet, curves are in the order of files and columns
+        """
         if type(files) is not list:
             files = [files]
 
         max_point_num = int(max_point_num)
-        data = []
+        raw_datas, names = [], []
         for f in files:
             print('Loading File: %s' % f)
             raw_data = np.genfromtxt(f, skip_header=skip)
+            raw_data = raw_data.reshape(raw_data.shape[0], -1)[:max_point_num]  # [points, columns]
             raw_data[np.isnan(raw_data)] = nan_value
+            raw_datas.append(raw_data)
+
+            name = os.path.splitext(os.path.basename(f))[0]
+            names += [name] if raw_data.shape[1] == 1 else ['%s:%d' % (name, i) for i in range(raw_data.shape[1])]
+
+        """ Copy all columns into a single array """
+        lengths = [d.shape[0] for d in raw_datas for _ in range(d.shape[1])]
+        values = np.full((max(lengths + [0]), len(lengths)), np.nan, dtype=dtype, order='F')
+        col = 0
+        for raw_data in raw_datas:
+            values[:raw_data.shape[0], col:col + raw_data.shape[1]] = raw_data
+            col += raw_data.shape[1]
 
-            if raw_data.ndim == 1:
-                data.append(raw_data[:max_point_num])
-            elif raw_data.ndim == 2:
-                # If contains multiple column data, split it into multiple separate columns
-                raw_data = np.split(raw_data, raw_data.shape[1], axis=1)
-                for i in range(len(raw_data)):
-                    data.append(raw_data[i][:max_point_num, 0])
+        data = CurveSet(values, lengths, names)
         if max_curve_num > 0:
             data = data[:int(max_curve_num)]
         return data
@@ -176,7 +422,12 @@ class PlotAgent(object):
         parent_dir = os.path.basename(save_dir)
         conf_name = os.path.splitext(os.path.basename(self.conf['confname']))[0]
 
-        save_name = save_prefix + parent_dir + '_' + conf_name + '.' + self.conf['format']
+        if len(self.sweep_values) > 0:
+            """ A variant of a sweep """
+            sweep_name = self.conf['sweep_name'] if self.conf['sweep_name'] != '' else '{index}'
+            conf_name += '_' + re.sub(r'[^\w.-]+', '_', sweep_name.format(**self.sweep_values))
+
+        save_name = save_prefix + parent_dir + '_' + conf_name + '.' + self.conf['format'][0]
         save_name = os.path.join(save_dir, save_name)
         print('Save name: %s' % save_name)
         return save_name
@@ -210,8 +461,124 @@ class PlotAgent(object):
             if conf['ylabel'][0] not in ['', 'None', None]:
                 ax.set_ylabel(conf['ylabel'][0], fontsize=conf['ylabel_font'], fontweight='book')
 
-    def save_fig(self, save_name):
-        plt.savefig(os.path.join(save_name), bbox_inches='tight')
+    def save_fig(self, save_name, fig=None, dpi='figure'):
+        """ Save the current figure, or the given figure, with the output options in the config """
+        fig = plt.gcf() if fig is None else fig
+        fmt = os.path.splitext(save_name)[1][1:].lower() or self.conf['format'][0]
+        content = self.get_fig_bytes(fig, fmt, dpi)
+        with open(save_name, 'wb') as f:
+            f.write(content)
+
+        if self.conf['size_report']:
+            default_size = len(self.render_fig(fig, fmt, {}, {}, dpi))
+            print('Size of %s: %d bytes, %d bytes with the default options, saved %d bytes (%.1f%%)' % (
+                save_name, len(content), default_size, default_size - len(content),
+                100.0 * (default_size - len(content)) / max(default_size, 1)))
+
+    def save_fig_formats(self, save_name, fig=None):
+        """ Save the figure in every format of the config, return the list of saved filenames
+        The vector formats are saved one by one. For the raster formats, the canvas is drawn once for each dpi
+        in the main thread (pyplot is not thread-safe), and the pixels are encoded to files in parallel threads.
+        """
+        fig = plt.gcf() if fig is None else fig
+        formats = self.conf['format']
+        save_names = [os.path.splitext(save_name)[0] + '.' + fmt for fmt in formats]
+        if len(formats) == 1:
+            self.save_fig(save_names[0], fig, self.get_format_dpi(formats[0]))
+            return save_names
+
+        raster_jobs = {}  # dpi: [(format, save_name)]
+        for fmt, name in zip(formats, save_names):
+            if fmt in RASTER_FORMATS:
+                raster_jobs.setdefault(self.get_format_dpi(fmt), []).append((fmt, name))
+            else:
+                self.save_fig(name, fig, self.get_format_dpi(fmt))
+
+        with ThreadPoolExecutor(max_workers=len(formats)) as pool:
+            jobs = []
+            for dpi, outputs in raster_jobs.items():
+                image = self.render_rgba(fig, dpi)
+                dpi = fig.dpi if dpi == 'figure' else dpi
+                jobs += [pool.submit(self.save_rgba, image, name, fmt, dpi) for fmt, name in outputs]
+            for job in jobs:
+                job.result()
+        return save_names
+
+    def get_format_dpi(self, fmt):
+        """ format_dpi is a list of format:dpi, e.g., png:300 """
+        for item in self.conf['format_dpi']:
+            name, dpi = item.split(':')
+            if name == fmt:
+                return float(dpi)
+        return 'figure'
+
+    def render_rgba(self, fig, dpi='figure'):
+        """ Draw the figure on the Agg canvas, return the pixels as a uint8 array of shape [H, W, 4] """
+        buf = _RGBABuffer()
+        with plt.rc_context(self.get_output_rc()):
+            fig.savefig(buf, format='rgba', bbox_inches='tight', dpi=dpi)
+        return buf.image
+
+    def save_rgba(self, image, save_name, fmt, dpi):
+        """ Encode the pixels in the same way as savefig, this does not touch the figure and is thread-safe """
+        from matplotlib.image import imsave
+        metadata = self.get_output_metadata(fmt)
+        fmt = 'tiff' if fmt == 'tif' else fmt  # the name known by PIL
+        imsave(save_name, image, format=fmt, dpi=dpi, metadata=metadata if len(metadata) > 0 else None)
+        print('Saved %s' % save_name)
+
+    def get_fig_bytes(self, fig, fmt, dpi='figure'):
+        """ Render the figure to bytes in the given format """
+        content = self.render_fig(fig, fmt, self.get_output_rc(), self.get_output_metadata(fmt), dpi)
+        if fmt == 'svg' and self.conf['strip_metadata']:
+            content = self.strip_svg_ids(content)
+        return content
+
+    def render_fig(self, fig, fmt, rc, metadata, dpi='figure'):
+        buf = io.BytesIO()
+        with plt.rc_context(rc):
+            if len(metadata) > 0:
+                fig.savefig(buf, format=fmt, bbox_inches='tight', dpi=dpi, metadata=metadata)
+            else:
+                fig.savefig(buf, format=fmt, bbox_inches='tight', dpi=dpi)
+        return buf.getvalue()
+
+    def get_output_rc(self):
+        """ rcParams for the output size, they are read by the backends when saving
+        https://matplotlib.org/stable/users/explain/customizing.html
+        """
+        conf = self.conf
+        rc = {'pdf.fonttype': int(conf['font_type']), 'ps.fonttype': int(conf['font_type']),
+              'pdf.compression': int(conf['pdf_compression']), 'path.simplify': conf['path_simplify']}
+
+        """ Vector backends draw at 72 dpi, so one pixel of the canvas dpi is 72/dpi in their units """
+        if conf['simplify_threshold'] == 'auto':
+            rc['path.simplify_threshold'] = min(72.0 / conf['dpi'], 1.0)
+        elif conf['simplify_threshold'] != 'default':
+            rc['path.simplify_threshold'] = float(conf['simplify_threshold'])
+
+        if conf['strip_metadata']:
+            rc['svg.hashsalt'] = 'plot_agent'  # fixed ids, so that the same figure gives the same file
+        return rc
+
+    def get_output_metadata(self, fmt):
+        """ Metadata set to None is not written to the file """
+        if not self.conf['strip_metadata']:
+            return {}
+        if fmt == 'pdf':
+            return {'Creator': None, 'Producer': None, 'CreationDate': None}
+        if fmt == 'svg':
+            return {'Creator': None, 'Date': None, 'Format': None, 'Type': None}
+        if fmt == 'png':
+            return {'Software': None}
+        return {}
+
+    def strip_svg_ids(self, content):
+        """ matplotlib gives an id to every group, only the ids referenced by clip paths and glyphs are kept """
+        text = content.decode('utf-8')
+        refs = set(re.findall(r'#([\w.:-]+)', text))
+        text = re.sub(r' id="([^"]*)"', lambda m: m.group(0) if m.group(1) in refs else '', text)
+        return text.encode('utf-8')
 
     def close_fig(self, fig):
         plt.close(fig)
@@ -238,7 +605,25 @@ class PlotCurveAgent(PlotAgent):
                 # Dot:
                 'draw_dot': 0,  # if plot dot?
                 'dotsize': 8,  # dot setting
+
+                # Aggregation over seeds, each curve is the mean of the files matched by a glob:
+                'seed_files': [],  # a glob for each curve, e.g., data/methodA_seed*.txt data/methodB_seed*.txt
+                'band': 'std',  # band around the mean: std|minmax|percentile|None
+                'band_std': 1.0,  # band of mean +- band_std * std
+                'band_percentile': ['25', '75'],  # lower and upper percentiles of the band
+                'band_alpha': 0.2,  # transparency of the band
+                'seed_streaming': False,  # accumulate the seeds one file at a time, percentile is not supported
+                'seed_cache': True,  # cache the aggregated curves next to the seed files
+
+                # Smoothing and resampling:
+                'smooth': 'None',  # None|ema|mean|median
+                'smooth_weight': 0.6,  # weight of the EMA (TensorBoard-style), in [0, 1)
+                'smooth_window': 11,  # window size of the rolling mean/median
+                'resample': 'None',  # None|uniform|log, resample the curves onto a uniform or log-spaced x grid
+                'resample_num': 500,  # number of points after resampling
+                'xscale': 'linear',  # linear|log
                 })
+        self.data_params += ['seed_files', 'band', 'band_std', 'band_percentile', 'seed_streaming', 'seed_cache']
 
     def get_default_markers(self):
         """ https://matplotlib.org/stable/api/_as_gen/matplotlib.pyplot.plot.html """
@@ -259,10 +644,19 @@ class PlotCurveAgent(PlotAgent):
                 line_style = conf['line_style'][idx] if len(conf['line_style']) > idx else '-'
                 ax.plot(x, y, color=conf['color'][idx], linestyle=line_style, linewidth=conf['linewidth'],
                         marker=conf['marker'][idx], markersize=conf['markersize'])
+
+        """ Draw the bands of the aggregated curves after the lines, so the legend labels the lines """
+        bands = conf.get('bands', [])
+        for idx, (x, (lower, upper)) in enumerate(zip(xs, bands)):
+            ax.fill_between(x, lower, upper, color=conf['color'][idx], alpha=float(conf['band_alpha']), linewidth=0)
         
+        if conf['xscale'] != 'linear':
+            ax.set_xscale(conf['xscale'])
+
         """ Set value range of the x- and y-axis """
-        x_min, x_max = self.set_xmin_xmax(np.min(xs), np.max(xs), conf)
-        y_min, y_max = self.set_ymin_ymax(np.min(ys), np.max(ys), conf)
+        x_min, x_max = self.set_xmin_xmax(*self.get_value_range(xs), conf)
+        y_min, y_max = self.get_value_range(list(ys) + [b for band in bands for b in band])
+        y_min, y_max = self.set_ymin_ymax(y_min, y_max, conf)
         print([x_min, x_max, y_min, y_max])
         ax.axis([x_min, x_max, y_min, y_max])
 
@@ -270,6 +664,229 @@ class PlotCurveAgent(PlotAgent):
         if decorate:
             self.decorate_plot(ax, conf, xticks=xs[0], yticks=[])
 
+    def smooth_curves(self, xs, ys, conf):
+        """ Smooth and then resample the curves (and the bands in conf['bands']), return new lists of x and y """
+        if conf['smooth'] == 'None' and conf['resample'] == 'None':
+            return xs, ys
+
+        new_xs, new_ys, new_bands = [], [], []
+        for idx, (x, y) in enumerate(zip(xs, ys)):
+            curves = [y] + list(conf['bands'][idx] if idx < len(conf.get('bands', [])) else [])
+            curves = [self.smooth(c, conf) for c in curves]
+            new_x, curves = self.resample(x, curves, conf)
+            new_xs.append(new_x)
+            new_ys.append(curves[0])
+            if len(curves) > 1:
+                new_bands.append(tuple(curves[1:]))
+
+        if len(conf.get('bands', [])) > 0:
+            conf['bands'] = new_bands
+        return new_xs, new_ys
+
+    def smooth(self, y, conf):
+        """ Smooth a curve in O(N) without looping over the points """
+        method = conf['smooth']
+        if method == 'None' or len(y) == 0:
+            return y
+        elif method == 'ema':
+            return self.ema(y, float(conf['smooth_weight']))
+        elif method in ['mean', 'median']:
+            return self.rolling(y, int(conf['smooth_window']), method)
+        else:
+            raise Exception('Unknown smooth method %s' % method)
+
+    def ema(self, y, weight):
+        """ Debiased exponential moving average, the same as the smoothing of TensorBoard:
+            last = last * weight + (1 - weight) * y[t]; smoothed[t] = last / (1 - weight^(t+1))
+        Within a block, the EMA is a cumulative sum of y[t] * weight^(-t), rescaled by weight^t.
+        The blocks are short enough that the cumulative sum (up to block * max|y| * weight^(-block)) does not
+        overflow, and the EMA is carried between blocks.
+        """
+        assert 0 <= weight < 1, 'smooth_weight should be in [0, 1)'
+        y = np.asarray(y, dtype=np.float64)
+        if weight == 0:
+            return y.copy()
+
+        finite = np.abs(y[np.isfinite(y)])
+        y_max = max(finite.max() if len(finite) > 0 else 1.0, 1.0)
+        budget = 300 - np.log10(y_max) - np.log10(len(y) + 1)  # block * max|y| * weight^(-block) < 1e300
+        block = max(int(budget / -np.log10(weight)), 1)
+        powers = weight ** np.arange(1, block + 1)  # weight^(j+1) for the j-th point in a block
+        smoothed = np.empty_like(y)
+        last = 0.0
+        for start in range(0, len(y), block):  # a few blocks, each block is vectorized
+            y_block = y[start:start + block]
+            p = powers[:len(y_block)]
+            smoothed[start:start + block] = p * (last + (1 - weight) * np.cumsum(y_block / p))
+            last = smoothed[start + len(y_block) - 1]
+
+        debias = 1 - weight ** np.arange(1, len(y) + 1)
+        return smoothed / debias
+
+    def rolling(self, y, window, method='mean'):
+        """ Centered rolling mean (with cumulative sums) or median (with a strided window view)
+        The curve is padded with its edge values, so that the length is unchanged
+        """
+        window = max(window, 1)
+        left = (window - 1) // 2
+        padded = np.pad(np.asarray(y, dtype=np.float64), (left, window - 1 - left), mode='edge')
+        if method == 'mean':
+            csum = np.concatenate([[0.0], np.cumsum(padded)])
+            return (csum[window:] - csum[:-window]) / window
+        return np.median(np.lib.stride_tricks.sliding_window_view(padded, window), axis=1)
+
+    def resample(self, x, curves, conf):
+        """ Linearly interpolate the curves onto a uniform or log-spaced x grid, x should be increasing """
+        method = conf['resample']
+        if method == 'None' or len(x) < 2:
+            return x, curves
+
+        num = int(conf['resample_num'])
+        if method == 'uniform':
+            new_x = np.linspace(x[0], x[-1], num)
+        elif method == 'log':
+            positive = x[x > 0]
+            assert len(positive) > 0, 'Log resampling requires positive x values'
+            new_x = np.geomspace(positive[0], x[-1], num)
+        else:
+            raise Exception('Unknown resample method %s' % method)
+        return new_x, [np.interp(new_x, x, c) for c in curves]
+
+    def aggregate_seed_files(self, conf, skip=0, nan_value=0):
+        """ Aggregate the seed files of each curve into the mean curve and a band
+        conf['seed_files'] contains a glob for each curve, the matched files are the runs of different seeds.
+        For ploty, each file contains the y values; for plotxy, each file contains x and y in two columns.
+        Return a CurveSet in the same layout as load_data_from_file, the bands are stored in conf['bands']
+        """
+        assert conf['sort_data'] == 'None', 'sort_data is not supported for aggregated curves'
+        columns, names, bands = [], [], []
+        for pattern in conf['seed_files']:
+            files = sorted(glob.glob(pattern))
+            if len(files) == 0 and not os.path.isabs(pattern):
+                """ Use relative path """
+                files = sorted(glob.glob(os.path.join(os.path.dirname(conf['confname']), pattern)))
+            if len(files) == 0:
+                raise Exception('No seed files found: %s' % pattern)
+            print('Aggregating %d seed files: %s' % (len(files), pattern))
+
+            stats = self.load_seed_cache(files, conf) if conf['seed_cache'] else None
+            if stats is None:
+                stats = self.compute_seed_stats(files, conf, skip, nan_value)
+                if conf['seed_cache']:
+                    self.save_seed_cache(files, conf, stats)
+
+            if conf['plot_type'] == 'plotxy':
+                columns.append(stats['x'])
+                names.append(os.path.basename(pattern) + ':x')
+            columns.append(stats['mean'])
+            names.append(os.path.basename(pattern))
+            bands.append((stats['lower'], stats['upper']))
+
+        conf['bands'] = bands if conf['band'] != 'None' else []
+        return CurveSet.from_columns(columns, names, dtype=conf['data_dtype'])
+
+    def read_seed_file(self, fname, conf, skip=0, nan_value=0):
+        """ Return x (None for ploty) and y of a seed file """
+        raw_data = np.genfromtxt(fname, skip_header=skip)
+        raw_data = raw_data.reshape(raw_data.shape[0], -1)[:int(conf['max_point_num'])]
+        raw_data[np.isnan(raw_data)] = nan_value
+        if conf['plot_type'] == 'plotxy':
+            return raw_data[:, 0], raw_data[:, 1]
+        return None, raw_data[:, 0]
+
+    def compute_seed_stats(self, files, conf, skip=0, nan_value=0):
+        """ Compute the mean and band over the seeds, seeds with more points are truncated to the shortest seed
+        By default, all seeds are stacked into an array of shape [nseeds, npoints] and reduced along the first axis.
+        In the streaming mode, mean and std (Welford's algorithm) and min/max are accumulated one file at a time.
+        """
+        band = conf['band']
+        assert band in ['std', 'minmax', 'percentile', 'None'], 'Unknown band %s' % band
+
+        if not conf['seed_streaming']:
+            seeds = [self.read_seed_file(f, conf, skip, nan_value) for f in files]
+            n = min([len(y) for x, y in seeds])
+            ys = np.stack([y[:n] for x, y in seeds])
+            x = seeds[0][0][:n] if seeds[0][0] is not None else np.arange(n, dtype=float)
+            for f, (x_i, y) in zip(files[1:], seeds[1:]):
+                self.check_seed_x(x, x_i, f, files[0])
+            mean, std = ys.mean(0), ys.std(0)
+            if band == 'minmax':
+                lower, upper = ys.min(0), ys.max(0)
+            elif band == 'percentile':
+                lower, upper = np.percentile(ys, list(map(float, conf['band_percentile'][:2])), axis=0)
+        else:
+            if band == 'percentile':
+                raise Exception('Percentile band is not supported in the seed_streaming mode')
+            for i, f in enumerate(files):
+                x_i, y = self.read_seed_file(f, conf, skip, nan_value)
+                if i == 0:
+                    x = x_i if x_i is not None else np.arange(len(y), dtype=float)
+                    mean, m2, y_min, y_max = y.astype(float), np.zeros(len(y)), y.copy(), y.copy()
+                    continue
+                n = min(len(mean), len(y))
+                x, mean, m2, y_min, y_max, y = x[:n], mean[:n], m2[:n], y_min[:n], y_max[:n], y[:n]
+                self.check_seed_x(x, x_i, f, files[0])
+                delta = y - mean
+                mean += delta / (i + 1)
+                m2 += delta * (y - mean)
+                np.minimum(y_min, y, out=y_min)
+                np.maximum(y_max, y, out=y_max)
+            std = np.sqrt(m2 / len(files))
+            if band == 'minmax':
+                lower, upper = y_min, y_max
+
+        if band in ['std', 'None']:
+            lower, upper = mean - conf['band_std'] * std, mean + conf['band_std'] * std
+        return {'x': x, 'mean': mean, 'std': std, 'lower': lower, 'upper': upper}
+
+    def check_seed_x(self, x, x_i, fname, first_name):
+        """ The seeds are averaged point by point, so the (truncated) x values of plotxy must be the same """
+        if x_i is not None and not np.array_equal(x, x_i[:len(x)]):
+            raise Exception('The x values of %s differ from %s, the seeds must be logged at the same x' % (
+                fname, first_name))
+
+    def get_seed_cache_path(self, files, conf):
+        """ The key of the cache contains the path, mtime, and size of the seed files, and the aggregation settings """
+        params = json.dumps([[k, conf[k]] for k in ['plot_type', 'max_point_num', 'band', 'band_std', 'band_percentile']])
+        key = json.dumps([[f, os.path.getmtime(f), os.path.getsize(f)] for f in files]) + params
+
+        """ Different aggregation settings are cached in different files """
+        cache_name = '.%s_seeds_%s.npz' % (os.path.splitext(os.path.basename(files[0]))[0],
+                hashlib.md5(params.encode('utf-8')).hexdigest()[:8])
+        return os.path.join(os.path.dirname(files[0]), cache_name), key
+
+    def load_seed_cache(self, files, conf):
+        cache_path, key = self.get_seed_cache_path(files, conf)
+        if not os.path.exists(cache_path):
+            return None
+        with np.load(cache_path) as cache:
+            if str(cache['key']) != key:
+                return None
+            print('Loading cached aggregation: %s' % cache_path)
+            return {k: cache[k] for k in ['x', 'mean', 'std', 'lower', 'upper']}
+
+    def save_seed_cache(self, files, conf, stats):
+        """ Write to a temporary file first, so that a partially written cache is never loaded """
+        cache_path, key = self.get_seed_cache_path(files, conf)
+        tmp_path = '%s.%d.%d.tmp' % (cache_path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, key=key, **stats)
+        os.replace(tmp_path, cache_path)
+
+    def get_value_range(self, curves):
+        """ Global min and max of a CurveSet or a list of curves, the curves can have different lengths
+        Each curve is reduced separately, so the curves are not concatenated into a new array
+        """
+        if isinstance(curves, CurveSet):
+            return curves.min_max()
+
+        curves = [c for c in curves if len(c) > 0]
+        if len(curves) == 0:
+            return np.nan, np.nan
+        if all([c is curves[0] for c in curves]):  # e.g., curves share the same x values
+            return np.min(curves[0]), np.max(curves[0])
+        return min([np.min(c) for c in curves]), max([np.max(c) for c in curves])
+
     def decorate_plot(self, ax, conf, xticks=[], yticks=[]):
         """ Place title, xlabel, ylabel, xticklabel, yticklabel, grid, etc """
 
@@ -431,12 +1048,14 @@ class PlotCurveAgent(PlotAgent):
         return order
     
     def sort_data(self, xs, ys, sort='None'):
+        """ Sort the points of all curves by the y values of the first curve
+        The curves and xticklabel are reordered with one fancy index, new curves are returned
+        """
         """ Check if the input are valid"""
         assert sort in ['None', 'ascend', 'descend']
 
-        for i in range(1, len(xs)):
-            if not np.array_equal(xs[i-1], xs[i]):
-                raise Exception('x values are not equal, cannot be sorted')
+        if not self.is_same_x(xs):
+            raise Exception('x values are not equal, cannot be sorted')
 
         if sort == 'None': # Do not sort
             return xs, ys
@@ -445,13 +1064,25 @@ class PlotCurveAgent(PlotAgent):
         if sort == 'descend':
             order = order[::-1]
 
-        for i in range(len(xs)):
-            ys[i] = ys[i][order]
+        if isinstance(ys, CurveSet):
+            ys = ys.take_points(order)
+        else:
+            ys = list(np.stack(ys, 1)[order].T)
 
         if len(self.conf['xticklabel']) > 0:  # sort xticklabel as well
-            self.conf['xticklabel'] = [self.conf['xticklabel'][id] for id in order]
+            self.conf['xticklabel'] = np.asarray(self.conf['xticklabel'])[order].tolist()
         return xs, ys
 
+    def is_same_x(self, xs):
+        """ Check if all curves have the same x values """
+        if len(xs) < 2:
+            return True
+        if isinstance(xs, CurveSet):
+            n = xs.lengths[0]
+            return all([l == n for l in xs.lengths]) and bool((xs.values[:n] == xs.values[:n, :1]).all())
+
+        return all([(x is xs[0]) or np.array_equal(x, xs[0]) for x in xs[1:]])
+
 
 class PlotBarAgent(PlotCurveAgent):
     """ Helper class for plotting curves """
@@ -473,6 +1104,14 @@ class PlotBarAgent(PlotCurveAgent):
                 'text_font': 13,
                 'text_prec': '',  # precision of values in the barchart, e.g., %.2f, %.1f
                 'percentage': False,  # Show values in percentage
+
+                # Large barcharts:
+                'bar_engine': 'auto',  # auto|axes|collection, collection draws all bars as a single artist
+                'bar_layout': 'grouped',  # grouped|stacked, only supported by the collection engine
+                'horizontal': False,  # horizontal bars, only supported by the collection engine
+                'max_groups_per_page': 0,  # split the groups into multiple figures, 0 for a single figure
+                'max_ticklabels': 0,  # show every k-th xticklabel so that they fit the axis length, >0 is an upper bound
+                'max_text_num': 200,  # do not put text if there are more bars
                 })
 
     def load_data_from_file(self, files, skip=0):
@@ -488,11 +1127,16 @@ class PlotBarAgent(PlotCurveAgent):
             raw_data = raw_data.reshape(1, -1)
         return raw_data
 
-    def plot_barchart(self, ax, data, conf):
+    def plot_barchart(self, ax, data, conf, groups=None):
         """
         ax: handler from plt.subplots()
         data: 2D array, column number is the group number, row number is the bar number in each group
+        groups: a slice of the groups to plot (a page), all groups by default
         """
+        if self.get_bar_engine(data, conf) == 'collection':
+            self.plot_barchart_collection(ax, data, conf, groups)
+            return
+
         ngroups = data.shape[1]
         nbars = data.shape[0]
 
@@ -525,6 +1169,154 @@ class PlotBarAgent(PlotCurveAgent):
         """ put title, labels, etc """
         self.decorate_bar(ax, conf)
 
+    def get_bar_engine(self, data, conf):
+        """ Use the collection engine for large barcharts and the layouts not supported by ax.bar """
+        engine = conf['bar_engine']
+        assert engine in ['auto', 'axes', 'collection'], 'Unknown bar_engine %s' % engine
+        paged = len(self.get_bar_pages(data, conf)) > 1
+        custom = conf['bar_layout'] != 'grouped' or conf['horizontal']
+        if engine == 'auto':
+            engine = 'collection' if data.shape[1] > 50 or paged or custom else 'axes'
+        elif engine == 'axes' and (paged or custom):
+            print('Warning: bar_engine axes does not support max_groups_per_page, horizontal and bar_layout, '
+                  'use the collection engine instead')
+            engine = 'collection'
+        return engine
+
+    def get_bar_pages(self, data, conf):
+        """ Split the groups into pages of at most max_groups_per_page groups """
+        ngroups = data.shape[1]
+        per_page = int(conf['max_groups_per_page'])
+        if per_page <= 0 or ngroups <= per_page:
+            return [slice(0, ngroups)]
+        return [slice(i, min(i + per_page, ngroups)) for i in range(0, ngroups, per_page)]
+
+    def plot_barchart_collection(self, ax, data, conf, groups=None):
+        """ Draw all bars as a single PolyCollection, the vertices of the bars are computed with array operations.
+        Supports grouped and stacked layouts, and horizontal bars. The value range is computed from all groups,
+        so that the pages of a barchart share the same axis.
+        """
+        from matplotlib.collections import PolyCollection
+        from matplotlib.colors import to_rgba_array
+        from matplotlib.patches import Patch
+
+        assert conf['bar_layout'] in ['grouped', 'stacked'], 'Unknown bar_layout %s' % conf['bar_layout']
+        stacked = conf['bar_layout'] == 'stacked'
+        groups = slice(0, data.shape[1]) if groups is None else groups
+        nbars = data.shape[0]
+        width = conf['bar_width']
+
+        """ Bottom and top of each bar, of shape [nbars, ngroups] """
+        if stacked:
+            tops = np.cumsum(data, axis=0)
+            bottoms = tops - data
+        else:
+            tops, bottoms = data, np.zeros_like(data)
+        value_min, value_max = min(0, bottoms.min(), tops.min()), max(0, tops.max())
+        tops, bottoms = tops[:, groups], bottoms[:, groups]
+        ngroups = tops.shape[1]
+
+        """ Center of each bar """
+        x_start = np.arange(1, ngroups + 1)
+        if stacked:
+            centers = np.repeat(x_start.reshape(1, -1), nbars, 0)
+            group_centers = x_start
+        else:
+            centers = x_start.reshape(1, -1) + np.arange(nbars).reshape(-1, 1) * width
+            group_centers = x_start + 0.5 * (nbars - 1) * width
+
+        """ Vertices of the bars, of shape [nbars * ngroups, 4, 2] """
+        left, right = (centers - width / 2).ravel(), (centers + width / 2).ravel()
+        bottoms, tops = bottoms.ravel(), tops.ravel()
+        verts = np.stack([np.stack([left, bottoms], 1), np.stack([left, tops], 1),
+                          np.stack([right, tops], 1), np.stack([right, bottoms], 1)], 1)
+        if conf['horizontal']:
+            verts = verts[:, :, ::-1]
+
+        alphas = [float(conf['opacity'][i] if len(conf['opacity']) > i else conf['opacity'][0]) for i in range(nbars)]
+        colors = to_rgba_array(conf['color'][:nbars])
+        colors[:, 3] = alphas
+        ax.add_collection(PolyCollection(verts, facecolors=np.repeat(colors, ngroups, 0), edgecolors='none'))
+
+        """ Set value range and position range """
+        value_min, value_max = self.set_ymin_ymax(value_min, value_max, conf)
+        pos_min, pos_max = left.min() - width / 2, right.max() + width / 2
+        if conf['horizontal']:
+            ax.set_xlim([value_min, value_max])
+            ax.set_ylim([pos_max, pos_min])  # the first group on the top
+        else:
+            ax.set_xlim([pos_min, pos_max])
+            ax.set_ylim([value_min, value_max])
+
+        """ Put text if there are not too many bars """
+        if conf['put_text'] and not stacked and nbars * ngroups <= conf['max_text_num']:
+            vertical_dist = (value_max - value_min) / 100
+            for i in range(nbars):
+                self.put_text(ax, centers[i], data[i, groups], vertical_dist, conf=conf, horizontal=conf['horizontal'])
+
+        """ Place title, labels, ticklabels, legend and grid """
+        super(PlotCurveAgent, self).decorate_plot(ax, conf)
+        self.set_group_ticks(ax, conf, group_centers, groups)
+
+        if len(conf['legend']) > 0:
+            handles = [Patch(facecolor=colors[i]) for i in range(min(nbars, len(conf['legend'])))]
+            kwargs = {}
+            if len(conf['bbox_to_anchor']) >= 2:
+                kwargs['bbox_to_anchor'] = tuple(map(float, conf['bbox_to_anchor'][:2]))
+            ax.legend(handles, conf['legend'][:len(handles)], loc=conf['legend_loc'], fontsize=conf['legend_font'],
+                    ncol=int(conf['legend_ncol']), handletextpad=0.1, **kwargs)
+
+        if conf['grid_on']:
+            (ax.xaxis if conf['horizontal'] else ax.yaxis).grid()
+        ax.set_axisbelow(True)
+
+    def set_group_ticks(self, ax, conf, group_centers, groups):
+        """ Label the groups, only every k-th label is shown if there are more than max_ticklabels groups """
+        group_axis, value_axis = ('y', 'x') if conf['horizontal'] else ('x', 'y')
+        ax.tick_params(axis=value_axis, labelsize=conf['ytick_font'])
+        ax.tick_params(axis=group_axis, labelsize=conf['xtick_font'])
+
+        if len(conf['xticklabel']) > 0:
+            labels = conf['xticklabel'][groups]
+            if len(labels) != len(group_centers):
+                print('Warning: %d xticklabels for %d groups' % (len(labels), len(group_centers)))
+                labels = (labels + [''] * len(group_centers))[:len(group_centers)]
+        else:
+            labels = [str(i + 1) for i in range(groups.start, groups.start + len(group_centers))]
+
+        step = int(np.ceil(len(labels) / float(self.get_max_ticklabels(ax, conf, labels))))
+        ticks, labels = group_centers[::step], labels[::step]
+
+        if conf['horizontal']:
+            ax.set_yticks(ticks)
+            ax.set_yticklabels(labels, rotation=conf['ytick_rot'])
+        else:
+            ax.set_xticks(ticks)
+            ax.set_xticklabels(labels, rotation=conf['xtick_rot'])
+
+    def get_max_ticklabels(self, ax, conf, labels):
+        """ Number of group labels that fit on the group axis without overlapping
+        The extent of a label along the axis is estimated from the font size, label length and rotation
+        """
+        from matplotlib.font_manager import FontProperties
+        horizontal = conf['horizontal']
+        size = FontProperties(size=conf['xtick_font']).get_size_in_points()
+        theta = np.deg2rad(float(conf['ytick_rot'] if horizontal else conf['xtick_rot']))
+        width = 0.6 * size * max([len(str(l)) for l in labels] + [1])  # approximate text size in points
+        height = 1.2 * size
+        if horizontal:
+            extent = abs(np.sin(theta)) * width + abs(np.cos(theta)) * height
+        else:
+            extent = abs(np.cos(theta)) * width + abs(np.sin(theta)) * height
+
+        bbox = ax.get_position()
+        fig_w, fig_h = ax.figure.get_size_inches()
+        length = (bbox.height * fig_h if horizontal else bbox.width * fig_w) * 72  # in points
+        max_num = max(int(length / (extent + 0.5 * size)), 1)
+        if int(conf['max_ticklabels']) > 0:
+            max_num = min(max_num, int(conf['max_ticklabels']))
+        return max_num
+
     def decorate_bar(self, ax, conf):
         """ Place title, xlabel, ylabel, xticklabel, yticklabel, grid, etc """
 
@@ -563,8 +1355,8 @@ class PlotBarAgent(PlotCurveAgent):
         if conf['grid_on']:
             ax.yaxis.grid()  # only show grid lines for yaxis
 
-    def put_text(self, ax, x_vals, y_vals, vertical_dist=0.5, conf={}):
-        """ Put text on the barchart"""
+    def put_text(self, ax, x_vals, y_vals, vertical_dist=0.5, conf={}, horizontal=False):
+        """ Put text on the barchart, for horizontal bars, the text is put on the right of the bars"""
 
         for x, y in zip(x_vals, y_vals):
 
@@ -578,6 +1370,9 @@ class PlotBarAgent(PlotCurveAgent):
                 text = '%d%%' % (y * 100)
             else:
                 text = prec % y
-            ax.text(x, y + vertical_dist, text, fontsize=conf['text_font'], 
-                    horizontalalignment='center')
+            if horizontal:
+                ax.text(y + vertical_dist, x, text, fontsize=conf['text_font'], verticalalignment='center')
+            else:
+                ax.text(x, y + vertical_dist, text, fontsize=conf['text_font'], 
+                        horizontalalignment='center')
 
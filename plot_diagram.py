@@ -1,8 +1,9 @@
 import argparse
+import asyncio
 import os
 import sys
-import numpy as np
-from plot_agent import PlotAgent
+from concurrent.futures import ThreadPoolExecutor
+from plot_agent import PlotAgent, CurveSet
 
 #from IPython.core import ultratb
 #sys.excepthook = ultratb.FormattedTB(call_pdb=True)
@@ -10,53 +11,160 @@ from plot_agent import PlotAgent
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
-    parser.add_argument('conf_file', default='', help='path of the config')
+    parser.add_argument('conf_file', nargs='+', help='path of the config, multiple configs are plotted in a batch')
     parser.add_argument('--save_prefix', default='', help='append string to the save filename')
-    parser.add_argument('--format', help='overwrite the save figure format, pdf|png|jpg')
+    parser.add_argument('--format', nargs='+', help='overwrite the save figure formats, e.g., --format pdf png svg')
+    parser.add_argument('--max_in_flight', default=2, type=int,
+            help='in batch mode, maximum number of figures loaded ahead of rendering')
     args = parser.parse_args()
     # args, unknown = parser.parse_known_args()
     return args
 
 
 def main(args):
+    conf_files = args.conf_file if type(args.conf_file) == list else [args.conf_file]
+
+    if len(conf_files) > 1:
+        """ Batch mode, load the data of the next figures while rendering the current figure """
+        return asyncio.run(plot_pipeline(conf_files, args.save_prefix, args.format, args.max_in_flight))
+
+    return plot_figure(conf_files[0], args.save_prefix, args.format)
+
+
+def plot_figure(conf_file, save_prefix='', format=None):
+    """ Plot a figure (or all variants of a sweep), return the save filename """
+    save_names = [render_figure(figure) for figure in load_figures(conf_file, save_prefix, format)]
+    return save_names[0] if len(save_names) == 1 else save_names
+
+
+async def plot_pipeline(conf_files, save_prefix='', format=None, max_in_flight=2):
+    """ Plot a batch of figures, loading (parsing and reading data files) runs in threads
+    and overlaps with rendering, which stays in the main thread as pyplot is not thread-safe.
+    At most max_in_flight figures are loaded but not yet rendered, to bound the memory.
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(max_in_flight)
+
+    async def load(conf_file):
+        await slots.acquire()  # released after the figure is rendered
+        return await loop.run_in_executor(executor, load_figures, conf_file, save_prefix, format)
+
+    save_names = []
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        loads = [asyncio.ensure_future(load(f)) for f in conf_files]
+        try:
+            for i, task in enumerate(loads):
+                figures = await task
+                try:
+                    print('[Figure %d/%d] Rendering %s' % (i+1, len(loads), conf_files[i]))
+                    save_names += [render_figure(figure) for figure in figures]
+                finally:
+                    slots.release()
+        finally:
+            for task in loads:
+                task.cancel()
+    return save_names
+
+
+def load_figures(conf_file, save_prefix='', format=None):
+    """ Parse the config and read the data files, this stage does not use pyplot
+    A config with sweep axes is parsed once and expanded into a figure for each variant,
+    variants with the same data settings share the loaded data. Return a list of figures
+    """
     plotAgent = PlotAgent()
 
     """ Load config """
-    conf = plotAgent.parse_config(args.conf_file, strict=False)
-        
-    """ Set save filename """
-    if args.format is not None:
-        conf['format'] = args.format
-    save_name = plotAgent.get_save_name(args.save_prefix)
+    conf = plotAgent.parse_config(conf_file, strict=False)
 
     if conf['plot_type'] in ['ploty', 'plotxy', 'plottwins']:
         """ plot curves """
-        plot_curves(args, save_name)
-
+        from plot_agent import PlotCurveAgent
+        agent = PlotCurveAgent()
     elif conf['plot_type'] == 'plotbar':
         """ plot barchart """
-        plot_barcharts(args, save_name)
+        from plot_agent import PlotBarAgent
+        agent = PlotBarAgent()
     else:
         raise Exception('Unknown plot type %s' % conf['plot_type'])
+    conf = agent.parse_config(conf_file)
 
+    """ Set save format """
+    if format is not None:
+        conf['format'] = format if type(format) == list else [format]
 
-def plot_curves(args, save_name):
-    """ Plot curves """
+    figures, loaded = [], {}
+    for variant in agent.expand_sweep():
+        key = variant.get_data_key()
+        if key not in loaded:
+            data = load_data(variant, variant.conf)
+            print('data', data)
+            loaded[key] = (data, variant.conf.get('bands'))
 
-    from plot_agent import PlotCurveAgent
-    plotCurveAgent = PlotCurveAgent()
+        data, bands = loaded[key]
+        if bands is not None:
+            variant.conf['bands'] = list(bands)  # the shared bands are replaced (e.g., by smoothing), not modified
+        save_name = variant.get_save_name(save_prefix)
+        if save_name in [f['save_name'] for f in figures]:
+            raise Exception('Sweep variants have the same save name %s, please include all axes in sweep_name' % save_name)
+        figures.append({'agent': variant, 'conf': variant.conf, 'data': data, 'save_name': save_name})
+    return figures
 
-    """ Load config """
-    conf = plotCurveAgent.parse_config(args.conf_file)
 
-    """ Read data """
-    data = plotCurveAgent.load_data_from_file(conf['datafile'], max_point_num=conf['max_point_num'])
-    print('data', data)
+def load_data(agent, conf):
+    """ Read data, or aggregate the seed files of each curve """
+    if conf['plot_type'] == 'plotbar':
+        return agent.load_data_from_file(conf['datafile'])
+
+    if len(conf['seed_files']) > 0:
+        return agent.aggregate_seed_files(conf)
+    return agent.load_data_from_file(conf['datafile'], max_point_num=conf['max_point_num'], dtype=conf['data_dtype'])
+
+
+def render_figure(figure):
+    """ Draw and save a loaded figure """
+    agent = figure['agent']
+    fig = draw_figure(figure)
+
+    if type(fig) != list:
+        save_names = agent.save_fig_formats(figure['save_name'], fig)
+        agent.close_fig(fig)
+        return save_names[0] if len(save_names) == 1 else save_names
+
+    """ Save each page of the figure """
+    save_names = []
+    for i, page_fig in enumerate(fig):
+        save_name = get_page_name(figure['save_name'], i)
+        print('Save page: %s' % save_name)
+        save_names += agent.save_fig_formats(save_name, page_fig)
+        agent.close_fig(page_fig)
+    return save_names
+
+
+def draw_figure(figure):
+    """ Draw a loaded figure without saving it, return a figure or a list of page figures """
+    agent, conf, data = figure['agent'], figure['conf'], figure['data']
+
+    if conf['plot_type'] == 'plotbar':
+        return draw_barcharts(agent, conf, data)
+    return draw_curves(agent, conf, data)
+
+
+def get_page_name(save_name, page):
+    """ Filename of a page of a multi-page figure """
+    return '%s_p%02d%s' % (os.path.splitext(save_name)[0], page, os.path.splitext(save_name)[1])
+
+
+def draw_curves(plotCurveAgent, conf, data):
+    """ Arrange the loaded data according to the plot type, and draw the curves
+    data is a CurveSet (or a list of 1D arrays), the curves passed to the plot functions are views of it
+    """
+    if type(data) == list:
+        data = CurveSet.from_columns(data)
 
     if conf['plot_type'] == 'ploty':
         """ The input data only contains Y values, the X values are generated as [0, ..., len(Y)]"""
         data_y = data
-        data_x = [np.array(range(len(y)), dtype=float) for y in data_y]  # set x as [0, len(y)]
+        data_x = [data.index_x(i) for i in range(len(data))]  # set x as [0, len(y)]
 
     elif conf['plot_type'] == 'plotxy':
         """ The input data contains both X and Y values """
@@ -65,13 +173,20 @@ def plot_curves(args, save_name):
 
     elif conf['plot_type'] == 'plottwins':
         """ The input data only contains Y values. Plot figure with two different Y-axis """
-        data0_xy = [np.array(range(len(data[0])), dtype=float), data[0]]
-        data1_xy = [np.array(range(len(data[1])), dtype=float), data[1]]
+        data0_xy = [data.index_x(0), data[0]]
+        data1_xy = [data.index_x(1), data[1]]
 
     else:
         raise Exception('Unknown plot type %s' % conf['plot_type'])
 
 
+    """ Smooth and resample the curves if required """
+    if conf['plot_type'] == 'plottwins':
+        (x0, x1), (y0, y1) = plotCurveAgent.smooth_curves([data0_xy[0], data1_xy[0]], [data0_xy[1], data1_xy[1]], conf)
+        data0_xy, data1_xy = [x0, y0], [x1, y1]
+    else:
+        data_x, data_y = plotCurveAgent.smooth_curves(data_x, data_y, conf)
+
     """ Configure figure layout"""
     fig, ax = plotCurveAgent.config_layout(conf, tight=True)
 
@@ -85,26 +200,24 @@ def plot_curves(args, save_name):
             data_x, data_y = plotCurveAgent.sort_data(data_x, data_y, sort=conf['sort_data'])
 
         plotCurveAgent.plot_xy(ax, data_x, data_y, conf)
-
-    plotCurveAgent.save_fig(save_name)
+    return fig
 
 
-def plot_barcharts(args, save_name):
-    """ Plot barcharts """
+def draw_barcharts(plotBarAgent, conf, data):
+    """ Draw the barchart, data is a 2D array
+    If the groups are split into pages (max_groups_per_page), return a list of figures, one for each page
+    """
+    pages = plotBarAgent.get_bar_pages(data, conf)
 
-    from plot_agent import PlotBarAgent
-    plotBarAgent = PlotBarAgent()
+    figs = []
+    for page in pages:
+        """ Configure figure layout"""
+        fig, ax = plotBarAgent.config_layout(conf, tight=True)
 
-    """ Load config """
-    conf = plotBarAgent.parse_config(args.conf_file)
-    data = plotBarAgent.load_data_from_file(conf['datafile'])
-    print('data', data)
-
-    """ Configure figure layout"""
-    fig, ax = plotBarAgent.config_layout(conf, tight=True)
+        plotBarAgent.plot_barchart(ax, data, conf, groups=page if len(pages) > 1 else None)
+        figs.append(fig)
+    return figs[0] if len(figs) == 1 else figs
 
-    plotBarAgent.plot_barchart(ax, data, conf)
-    plotBarAgent.save_fig(save_name)
 
 if __name__ == '__main__':
     args = parse_arguments()
@@ -0,0 +1,354 @@
+"""
+A render daemon that keeps matplotlib warm, and renders figures sent over a local Unix socket.
+
+Start the daemon:
+    python plot_server.py serve --workers 4
+Render figures with the client, a job is either a .conf path or a .json job file:
+    python plot_server.py render examples/demo/simple_plot.conf
+    python plot_server.py health
+    python plot_server.py metrics
+    python plot_server.py stop
+
+Protocol: each request and response is a JSON object in a single line.
+    {"cmd": "render", "conf_file": "path/to/a.conf", "save_prefix": "", "format": ["pdf", "png"], "return_bytes": false}
+    {"cmd": "render", "conf": {"plot_type": "ploty", "legend": ["A", "B"], ...}, "data": [[...], [...]],
+     "save_name": "path/to/out.pdf", "return_bytes": false}
+    {"cmd": "health"}, {"cmd": "metrics"}, {"cmd": "shutdown"}
+For a JSON conf, data is a list of curves (same as load_data_from_file) or a 2D list for plotbar,
+the figure is saved to save_name, or only returned as bytes if save_name is not given.
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cmd', help='serve|render|health|metrics|stop')
+    parser.add_argument('jobs', nargs='*', default=[], help='.conf or .json job files for render')
+    parser.add_argument('--socket', default='/tmp/plot_server.sock', help='path of the Unix socket')
+    parser.add_argument('--workers', default=4, type=int, help='number of render processes')
+    parser.add_argument('--verbose', default=False, action='store_true', help='print the logs of the plot agents')
+    parser.add_argument('--save_prefix', default='', help='append string to the save filename')
+    parser.add_argument('--format', nargs='+', help='overwrite the save figure formats, e.g., --format pdf png')
+    parser.add_argument('--bytes_dir', default='',
+            help='if set, request the rendered bytes and write them to this directory')
+    args = parser.parse_args()
+    return args
+
+
+""" Render workers, each worker process imports pyplot and loads fonts once """
+
+_verbose = False
+
+
+def init_worker(verbose):
+    global _verbose
+    _verbose = verbose
+    from plot_agent import load_pyplot
+    load_pyplot()
+    import plot_diagram  # import the draw functions as well
+
+
+def render_job(job):
+    """ Render a job in a worker, errors are returned instead of raised """
+    from plot_agent import load_pyplot
+    plt = load_pyplot()
+    start = time.time()
+    log = None if _verbose else io.StringIO()
+
+    try:
+        with contextlib.redirect_stdout(log) if log is not None else contextlib.nullcontext():
+            if 'conf_file' in job:
+                save_name, content = render_conf_file(job)
+            else:
+                save_name, content = render_conf_data(job)
+        result = {'ok': True, 'save_name': save_name}
+        if job.get('return_bytes', False):
+            result['bytes'] = base64.b64encode(content).decode('ascii')
+    except Exception as e:
+        result = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+    finally:
+        plt.close('all')
+
+    result['render_time'] = time.time() - start
+    return result
+
+
+def render_conf_file(job):
+    """ Render a .conf in the same way as plot_diagram.py """
+    import plot_diagram
+    args = argparse.Namespace(conf_file=job['conf_file'], save_prefix=job.get('save_prefix', ''),
+            format=job.get('format'))
+    save_name = plot_diagram.main(args)
+
+    content = None
+    if job.get('return_bytes', False):
+        with open(save_name[0] if type(save_name) == list else save_name, 'rb') as f:
+            content = f.read()
+    return save_name, content
+
+
+def render_conf_data(job):
+    """ Render a conf dict with the data sent in the job """
+    import plot_diagram
+    from plot_agent import PlotCurveAgent, PlotBarAgent
+
+    plot_type = job['conf'].get('plot_type', 'ploty')
+    if plot_type in ['ploty', 'plotxy', 'plottwins']:
+        agent = PlotCurveAgent()
+        data = [np.asarray(d, dtype=float) for d in job['data']]
+    elif plot_type == 'plotbar':
+        agent = PlotBarAgent()
+        data = np.asarray(job['data'], dtype=float).reshape(len(job['data']), -1)
+    else:
+        raise Exception('Unknown plot type %s' % plot_type)
+
+    conf = agent.update_config(job['conf'])
+    save_name = job.get('save_name', '')
+    conf['confname'] = save_name
+    if 'format' not in job['conf'] and os.path.splitext(save_name)[1] != '':
+        conf['format'] = [os.path.splitext(save_name)[1][1:]]  # use the format of the save_name
+    figure = {'agent': agent, 'conf': conf, 'data': data, 'save_name': save_name}
+
+    if save_name != '':
+        save_name = plot_diagram.render_figure(figure)
+        first_name = save_name[0] if type(save_name) == list else save_name
+        content = open(first_name, 'rb').read() if job.get('return_bytes', False) else None
+    else:
+        """ Only return the bytes, the first page is returned for a multi-page barchart """
+        fig = plot_diagram.draw_barcharts(agent, conf, data) if plot_type == 'plotbar' else \
+                plot_diagram.draw_curves(agent, conf, data)
+        fig = fig[0] if type(fig) == list else fig
+        content = agent.get_fig_bytes(fig, conf['format'][0])
+        agent.close_fig(fig)
+    return save_name, content
+
+
+""" Daemon """
+
+class RenderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Each connection is handled in a thread, the rendering is done by the worker pool """
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers, verbose):
+        """ Only remove a stale socket, do not take the socket of a running daemon """
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise Exception('%s exists and is not a socket' % socket_path)
+            if is_alive(socket_path):
+                raise Exception('A render server is already listening on %s' % socket_path)
+            os.remove(socket_path)
+
+        self.workers = workers
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.metrics = {'start_time': time.time(), 'jobs': 0, 'failed': 0, 'in_flight': 0,
+                        'render_time': 0.0, 'latency': 0.0, 'pool_restarts': 0}
+        self.pool = self.new_pool()
+        self.pool_broken = False
+        socketserver.UnixStreamServer.__init__(self, socket_path, RenderHandler)
+
+    def new_pool(self):
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=(self.verbose,))
+
+        """ Warm up all workers before accepting jobs """
+        list(pool.map(time.sleep, [0.01] * self.workers))
+        return pool
+
+    def restart_pool(self, broken_pool):
+        """ Replace a pool whose worker died (e.g., segfault or OOM kill), the pool is only replaced once
+        even if several jobs fail at the same time
+        """
+        with self.lock:
+            if self.pool is not broken_pool:
+                return
+            print('A render worker died, restarting the worker pool')
+            broken_pool.shutdown(wait=False)
+            try:
+                self.pool = self.new_pool()
+                self.pool_broken = False
+                self.metrics['pool_restarts'] += 1
+            except Exception as e:
+                print('Failed to restart the worker pool: %s' % e)
+                self.pool_broken = True
+
+    def render(self, job):
+        start = time.time()
+        with self.lock:
+            self.metrics['in_flight'] += 1
+
+        pool = self.pool
+        try:
+            result = pool.submit(render_job, job).result()
+        except (BrokenProcessPool, RuntimeError) as e:
+            """ The job is not retried, as it may be the one that killed the worker """
+            self.restart_pool(pool)
+            result = {'ok': False, 'error': '%s: a render worker died (%s)' % (type(e).__name__, e), 'render_time': 0.0}
+        finally:
+            with self.lock:
+                self.metrics['in_flight'] -= 1
+
+        with self.lock:
+            self.metrics['jobs'] += 1
+            self.metrics['failed'] += 0 if result['ok'] else 1
+            self.metrics['render_time'] += result['render_time']
+            self.metrics['latency'] += time.time() - start
+        return result
+
+    def get_health(self, timeout=5.0):
+        """ Send a no-op job to the pool, a broken pool is restarted. busy means the no-op job waited for other jobs """
+        pool = self.pool
+        try:
+            pool.submit(int).result(timeout=timeout)
+            status = 'ok'
+        except TimeoutError:
+            status = 'busy'
+        except (BrokenProcessPool, RuntimeError):
+            self.restart_pool(pool)
+            status = 'ok'
+
+        if self.pool_broken:
+            status = 'broken'
+        return {'ok': status != 'broken', 'status': status, 'pid': os.getpid(), 'workers': self.workers,
+                'pool_restarts': self.metrics['pool_restarts']}
+
+    def get_metrics(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+        jobs = max(metrics['jobs'], 1)
+        metrics['uptime'] = time.time() - metrics.pop('start_time')
+        metrics['mean_render_time'] = metrics['render_time'] / jobs
+        metrics['mean_latency'] = metrics['latency'] / jobs
+        metrics['workers'] = self.workers
+        return metrics
+
+
+class RenderHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if line.strip() == b'':
+                continue
+            try:
+                request = json.loads(line.decode('utf-8'))
+                cmd = request.get('cmd', 'render')
+                if cmd == 'render':
+                    response = self.server.render(request)
+                elif cmd == 'health':
+                    response = self.server.get_health()
+                elif cmd == 'metrics':
+                    response = dict(self.server.get_metrics(), ok=True)
+                elif cmd == 'shutdown':
+                    response = {'ok': True}
+                    threading.Thread(target=self.server.shutdown).start()
+                else:
+                    response = {'ok': False, 'error': 'Unknown cmd %s' % cmd}
+            except Exception as e:
+                response = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+def serve(args):
+    server = RenderServer(args.socket, args.workers, args.verbose)
+    print('Render server listening on %s with %d workers' % (args.socket, args.workers))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.pool.shutdown()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+""" Client """
+
+def request(socket_path, req):
+    """ Send a request to the daemon and wait for the response """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(req) + '\n').encode('utf-8'))
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline().decode('utf-8'))
+
+
+def is_alive(socket_path):
+    """ Whether a daemon accepts connections on the socket, a stale socket refuses them """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+            return True
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+
+
+def get_job(args, job_file):
+    """ A job is either a .conf path or a .json job file """
+    if job_file.endswith('.json'):
+        with open(job_file) as f:
+            job = json.load(f)
+    else:
+        job = {'conf_file': os.path.abspath(job_file), 'save_prefix': args.save_prefix, 'format': args.format}
+    job['cmd'] = 'render'
+    job['return_bytes'] = args.bytes_dir != ''
+    return job
+
+
+def render(args):
+    """ Send the jobs in parallel, so that the workers of the daemon can render them at the same time """
+    def run(job_file):
+        job = get_job(args, job_file)
+        return job_file, job, request(args.socket, job)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(len(args.jobs), 1)) as pool:
+        for job_file, job, result in pool.map(run, args.jobs):
+            if not result['ok']:
+                failed += 1
+                print('[Failed] %s: %s' % (job_file, result['error']))
+                continue
+
+            print('[%.3fs] %s -> %s' % (result['render_time'], job_file, result['save_name']))
+            if 'bytes' in result:
+                if not os.path.exists(args.bytes_dir):
+                    os.makedirs(args.bytes_dir)
+                save_name = result['save_name']
+                save_name = save_name[0] if type(save_name) == list else save_name  # bytes of the first file
+                if save_name == '':  # only rendered to bytes, name it after the job file
+                    fmt = job['conf'].get('format', 'pdf')
+                    save_name = os.path.splitext(job_file)[0] + '.' + (fmt[0] if type(fmt) == list else fmt)
+                save_name = os.path.join(args.bytes_dir, os.path.basename(save_name))
+                with open(save_name, 'wb') as f:
+                    f.write(base64.b64decode(result['bytes']))
+    return failed
+
+
+def main(args):
+    if args.cmd == 'serve':
+        serve(args)
+    elif args.cmd == 'render':
+        sys.exit(1 if render(args) > 0 else 0)
+    elif args.cmd in ['health', 'metrics']:
+        print(json.dumps(request(args.socket, {'cmd': args.cmd}), indent=1))
+    elif args.cmd == 'stop':
+        request(args.socket, {'cmd': 'shutdown'})
+    else:
+        raise Exception('Unknown cmd %s' % args.cmd)
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    main(args)
@@ -0,0 +1,63 @@
+""" Benchmark the startup time of plot_diagram.py, and guard the fast-start path
+Parsing a config (parse_config, get_save_name) should not import matplotlib, pyplot is imported on first render.
+Usage: python scripts/benchmark_startup.py [--conf_file examples/demo/simple_plot.conf] [--max_parse_time 0.5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+""" Run in a fresh interpreter, so that the measured time includes all imports """
+BENCH_CODE = '''
+import sys, time
+t0 = time.perf_counter()
+from plot_agent import PlotAgent
+agent = PlotAgent()
+conf = agent.parse_config(sys.argv[1], strict=False)
+agent.get_save_name('')
+t1 = time.perf_counter()
+mpl_loaded = 'matplotlib' in sys.modules
+fig, ax = agent.config_layout(conf)
+t2 = time.perf_counter()
+sys.stderr.write('%f %f %d\\n' % (t1 - t0, t2 - t1, mpl_loaded))
+'''
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conf_file', default=os.path.join(ROOT, 'examples/demo/simple_plot.conf'))
+    parser.add_argument('--repeat', default=3, type=int, help='number of runs, report the fastest run')
+    parser.add_argument('--max_parse_time', default=0.5, type=float,
+            help='fail if importing and parsing the config takes longer than this (seconds)')
+    args = parser.parse_args()
+    return args
+
+
+def run_once(conf_file):
+    proc = subprocess.run([sys.executable, '-c', BENCH_CODE, conf_file], cwd=ROOT,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    parse_time, render_time, mpl_loaded = proc.stderr.strip().splitlines()[-1].split(' ')
+    return float(parse_time), float(render_time), bool(int(mpl_loaded))
+
+
+def main(args):
+    results = [run_once(args.conf_file) for _ in range(args.repeat)]
+    parse_time = min([r[0] for r in results])
+    render_time = min([r[1] for r in results])
+    mpl_loaded = any([r[2] for r in results])
+
+    print('Import + parse config: %.3fs' % parse_time)
+    print('First render (import pyplot, set font, create figure): %.3fs' % render_time)
+
+    if mpl_loaded:
+        sys.exit('FAILED: matplotlib is imported when parsing the config')
+    if parse_time > args.max_parse_time:
+        sys.exit('FAILED: import + parse config takes %.3fs > %.3fs' % (parse_time, args.max_parse_time))
+    print('PASSED')
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    main(args)
@@ -0,0 +1,56 @@
+""" Check the vectorized smoothing of PlotCurveAgent against plain Python loops
+The EMA is compared with the TensorBoard recurrence on long curves with large values, where a naive rescaling overflows.
+Usage: python scripts/check_smoothing.py [--rtol 1e-6]
+"""
+import argparse
+import os
+import sys
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rtol', default=1e-6, type=float, help='relative tolerance to the reference loop')
+    args = parser.parse_args()
+    return args
+
+
+def ema_loop(y, weight):
+    """ Reference: the smoothing of TensorBoard """
+    smoothed, last = [], 0.0
+    for t, v in enumerate(y):
+        last = last * weight + (1 - weight) * v
+        smoothed.append(last / (1 - weight ** (t + 1)))
+    return np.array(smoothed)
+
+
+def main(args):
+    from plot_agent import PlotCurveAgent
+    agent = PlotCurveAgent()
+    rng = np.random.default_rng(0)
+
+    """ (weight, number of points, scale of the values) """
+    cases = [(0.6, 1000, 1.0), (0.6, 5000, 1e9), (0.9, 100000, 1e12), (0.99, 200000, 1e7),
+             (0.999, 200000, 1e5), (0.6, 10000, 1e-9)]
+    failed = 0
+    for weight, num, scale in cases:
+        y = scale * (1 + rng.standard_normal(num).cumsum() / np.sqrt(num))
+        smoothed, reference = agent.ema(y, weight), ema_loop(y, weight)
+        finite = np.isfinite(smoothed).all()
+        error = np.max(np.abs(smoothed - reference) / np.maximum(np.abs(reference), scale * 1e-12))
+        passed = finite and error <= args.rtol
+        failed += 0 if passed else 1
+        print('[%s] weight %g, %d points, values ~%g: max relative error %.2e%s' % (
+            'passed' if passed else 'FAILED', weight, num, scale, error, '' if finite else ', non-finite output'))
+
+    if failed > 0:
+        sys.exit('FAILED: %d of %d cases' % (failed, len(cases)))
+    print('PASSED')
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    main(args)
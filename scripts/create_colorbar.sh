@@ -1,4 +1 @@
-python img_tools/color_bar.py --colormap jet
-python img_tools/color_bar.py --colormap viridis
-python img_tools/color_bar.py --colormap viridis --horizontal
-python img_tools/color_bar.py --colormap jet --horizontal
+python img_tools/color_bar.py --colormap jet viridis --orientation vertical horizontal
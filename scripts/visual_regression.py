@@ -0,0 +1,235 @@
+""" Visual regression check of the examples, render every example .conf and compare it with its reference image
+The renders are not saved to the examples directory, they are compared in memory with the reference (by default,
+the .jpg next to the .conf that plot_diagram.py would write). Both images are downscaled and compared with
+SSIM and the maximum mean difference over tiles in each RGB channel, so that a change of the colors is detected,
+while small shifts of anti-aliasing and jpg noise are tolerated.
+A report with the diff image of each example is written to --out_dir.
+The reference jpgs in examples/ depend on the fonts and matplotlib version they were rendered with, a reference with
+a different size is reported as not comparable. Lossless (png) references rendered in the same environment with
+--ref_dir are compared at a higher resolution, and catch small changes such as a thinner line.
+
+Usage:
+    python scripts/visual_regression.py                            # compare with the reference jpgs in examples/
+    python scripts/visual_regression.py --ref_dir results/baseline --update   # render references, e.g., on main
+    python scripts/visual_regression.py --ref_dir results/baseline            # compare the branch with them
+"""
+import argparse
+import contextlib
+import glob
+import io
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('conf_files', nargs='*', default=sorted(glob.glob(os.path.join(ROOT, 'examples/*/*.conf'))),
+            help='configs to check, default all example configs')
+    parser.add_argument('--ref_dir', default='',
+            help='directory of the reference images, if not set, use the images next to the configs')
+    parser.add_argument('--ref_format', default='',
+            help='format of the reference images, jpg|png, default png with --ref_dir, otherwise jpg')
+    parser.add_argument('--update', default=False, action='store_true',
+            help='write the renders as the new reference images instead of comparing')
+    parser.add_argument('--out_dir', default=os.path.join(ROOT, 'results/visual_regression'),
+            help='save the diff images and report.html')
+    parser.add_argument('--size', default=0, type=int,
+            help='long side of the downscaled images to compare, default 1024 for png and 256 for jpg (jpg noise)')
+    parser.add_argument('--tile', default=16, type=int, help='tile size (in downscaled pixels) of the tile diff')
+    parser.add_argument('--min_ssim', default=0.98, type=float, help='fail if the mean SSIM is lower than this')
+    parser.add_argument('--max_tile_diff', default=0.1, type=float,
+            help='fail if the mean absolute difference of any tile is larger than this, intensities are in [0, 1]')
+    parser.add_argument('--workers', default=4, type=int, help='number of render processes')
+    args = parser.parse_args()
+    if args.ref_format == '':
+        args.ref_format = 'png' if args.ref_dir != '' else 'jpg'
+    if args.size <= 0:
+        args.size = 256 if args.ref_format in ['jpg', 'jpeg'] else 1024
+    return args
+
+
+""" Image metrics, images are float arrays of shape [H, W, 3] in [0, 1] """
+
+def box_filter(img, size):
+    """ Mean over all size x size windows (valid region) with an integral image """
+    c = np.pad(img, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    return (c[size:, size:] - c[:-size, size:] - c[size:, :-size] + c[:-size, :-size]) / (size * size)
+
+
+def ssim(a, b, win=7):
+    """ Minimum over the channels of the mean SSIM, a color change lowers the SSIM of the changed channels """
+    return min([ssim_channel(a[:, :, i], b[:, :, i], win) for i in range(a.shape[2])])
+
+
+def ssim_channel(a, b, win=7):
+    """ Mean SSIM of a channel with a uniform window, https://en.wikipedia.org/wiki/Structural_similarity """
+    c1, c2 = 0.01 ** 2, 0.03 ** 2
+    win = min(win, a.shape[0], a.shape[1])
+    mu_a, mu_b = box_filter(a, win), box_filter(b, win)
+    var_a = box_filter(a * a, win) - mu_a ** 2
+    var_b = box_filter(b * b, win) - mu_b ** 2
+    cov = box_filter(a * b, win) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return ssim_map.mean()
+
+
+def max_tile_diff(a, b, tile):
+    """ Maximum over tiles and channels of the mean absolute difference,
+    a local change is not averaged out by the whole image
+    """
+    h, w, c = a.shape
+    tile = min(tile, h, w)
+    th, tw = h // tile, w // tile
+    diff = np.abs(a - b)[:th * tile, :tw * tile].reshape(th, tile, tw, tile, c)
+    return diff.mean(axis=(1, 3)).max()
+
+
+def downscale(image, shape):
+    """ Resize a uint8 RGB image to shape (w, h) with box filtering, return the image in [0, 1] """
+    from PIL import Image
+    return np.asarray(Image.fromarray(image).resize(shape, Image.BOX), dtype=np.float64) / 255.0
+
+
+def compare_images(ref, new, args):
+    """ The render is resized to the shape of the reference, then both are downscaled to args.size """
+    h, w = ref.shape[:2]
+    scale = min(float(args.size) / max(h, w), 1.0)
+    shape = (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1))
+    ref_s, new_s = downscale(ref, shape), downscale(new, shape)
+
+    result = {'ssim': float(ssim(ref_s, new_s)), 'tile_diff': float(max_tile_diff(ref_s, new_s, args.tile)),
+              'same_size': ref.shape == new.shape}
+    result['passed'] = result['ssim'] >= args.min_ssim and result['tile_diff'] <= args.max_tile_diff
+    return result, ref_s, new_s
+
+
+def save_diff_image(save_name, ref_s, new_s):
+    """ Reference | render | maximum absolute difference over the channels (inferno colormap, scaled by 4) """
+    import matplotlib
+    from matplotlib.image import imsave
+    diff = matplotlib.colormaps['inferno'](np.clip(np.abs(ref_s - new_s).max(axis=2) * 4, 0, 1))[:, :, :3]
+    gap = np.ones((ref_s.shape[0], 4, 3))
+    imsave(save_name, np.concatenate([ref_s, gap, new_s, gap, diff], 1))
+
+
+""" Render and check an example in a worker process """
+
+def get_ref_name(save_name, args):
+    if args.ref_dir != '':
+        save_name = os.path.join(args.ref_dir, os.path.basename(save_name))
+    return os.path.splitext(save_name)[0] + '.' + args.ref_format
+
+
+def check_example(conf_file, args):
+    """ Return a result for each page of each figure, a config with sweep axes has a figure for each variant """
+    import plot_diagram
+    from matplotlib.image import imread
+
+    results = []
+    images = []  # [(save_name, agent, image)]
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            for figure in plot_diagram.load_figures(conf_file, format=args.ref_format):
+                agent = figure['agent']
+                fig = plot_diagram.draw_figure(figure)
+                figs = fig if type(fig) == list else [fig]
+                for i, page_fig in enumerate(figs):
+                    save_name = figure['save_name'] if len(figs) == 1 else \
+                            plot_diagram.get_page_name(figure['save_name'], i)
+                    images.append((save_name, agent, agent.render_rgba(page_fig)[:, :, :3]))
+                    agent.close_fig(page_fig)
+    except Exception as e:
+        return [{'conf_file': conf_file, 'name': os.path.basename(conf_file), 'status': 'error',
+                 'error': '%s: %s' % (type(e).__name__, e)}]
+
+    for save_name, agent, image in images:
+        ref_name = get_ref_name(save_name, args)
+        result = {'conf_file': conf_file, 'name': os.path.splitext(os.path.basename(ref_name))[0], 'ref': ref_name}
+
+        if args.update:
+            if not os.path.exists(os.path.dirname(ref_name)):
+                os.makedirs(os.path.dirname(ref_name))
+            agent.save_rgba(image, ref_name, args.ref_format, agent.conf['dpi'])
+            result['status'] = 'updated'
+        elif not os.path.exists(ref_name):
+            result['status'] = 'no reference'
+        else:
+            ref = imread(ref_name)
+            ref = (ref * 255).astype(np.uint8) if ref.dtype != np.uint8 else ref  # png is read as float
+            metrics, ref_s, new_s = compare_images(ref[:, :, :3], image, args)
+            result.update(metrics)
+            result['diff'] = os.path.join(args.out_dir, result['name'] + '_diff.png')
+            save_diff_image(result['diff'], ref_s, new_s)
+            if not result['same_size'] and args.ref_dir == '':
+                result['status'] = 'not comparable'  # e.g., rendered with other fonts
+            else:
+                result['status'] = 'passed' if result['passed'] else 'failed'
+        results.append(result)
+    return results
+
+
+def init_worker():
+    from plot_agent import load_pyplot
+    with contextlib.redirect_stdout(io.StringIO()):
+        load_pyplot()
+    logging.getLogger('matplotlib.font_manager').setLevel(logging.ERROR)  # a missing font is warned for each text
+
+
+def write_report(results, args):
+    rows = []
+    for r in results:
+        metrics = 'SSIM %.4f, tile diff %.4f%s' % (r['ssim'], r['tile_diff'], '' if r['same_size'] else ', size changed') \
+                if 'ssim' in r else r.get('error', '')
+        image = '<img src="%s" width="768">' % os.path.basename(r['diff']) if 'diff' in r else ''
+        rows.append('<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>' % (r['name'], r['status'], metrics, image))
+
+    save_name = os.path.join(args.out_dir, 'report.html')
+    with open(save_name, 'w') as f:
+        f.write('<html><body><h3>Visual regression: reference | render | difference</h3>\n<table border="1">\n')
+        f.write('<tr><th>Figure</th><th>Status</th><th>Metrics</th><th>Diff</th></tr>\n')
+        f.write('\n'.join(rows))
+        f.write('\n</table></body></html>\n')
+    return save_name
+
+
+def main(args):
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    conf_files = [os.path.abspath(f) for f in args.conf_files]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+        for conf_results in pool.map(check_example, conf_files, [args] * len(conf_files)):
+            for r in conf_results:
+                metrics = 'SSIM %.4f, tile diff %.4f' % (r['ssim'], r['tile_diff']) if 'ssim' in r else r.get('error', '')
+                print('[%s] %s %s' % (r['status'], r['name'], metrics))
+            results += conf_results
+
+    if args.update:
+        print('Updated %d reference images' % len(results))
+        return
+
+    print('Report: %s' % write_report(results, args))
+    failed = [r for r in results if r['status'] in ['failed', 'error']]
+    if len(failed) > 0:
+        sys.exit('FAILED: %d of %d figures' % (len(failed), len(results)))
+    not_comparable = len([r for r in results if r['status'] in ['not comparable', 'no reference']])
+    if not_comparable > 0:
+        print('%d of %d figures have no comparable reference, render references in this environment with '
+              '--ref_dir results/baseline --update (e.g., on main) and compare with --ref_dir results/baseline' % (
+              not_comparable, len(results)))
+    if not_comparable == len(results):
+        sys.exit('FAILED: no figure was compared')
+    print('PASSED')
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    main(args)